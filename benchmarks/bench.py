@@ -0,0 +1,330 @@
+"""Benchmarks for JsonRpcRouter.
+
+Requests are sent in process over ASGI without network. Each scenario is run
+`--repeat` times and the medians are compared with a baseline saved on the same
+machine. A scenario is a regression when it is slower than the baseline by more
+than `--threshold` plus the spread observed between the repeated runs.
+
+    python -m benchmarks.bench --save         # record the baseline of this machine
+    python -m benchmarks.bench                # compare with benchmarks/baseline.json
+    python -m benchmarks.bench -k batch       # run matching scenarios only
+
+`peak B` is the tracemalloc peak of traced memory during one call, not a count
+of allocations.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+from starlette.websockets import WebSocketState
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.websocket import JsonRpcWebSocket
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+PATH = "/jsonrpc/"
+
+Call = Callable[[], Awaitable[None]]
+Setup = Callable[[], Awaitable[Tuple[Call, Callable[[], Awaitable[None]]]]]
+
+
+def create_app():
+    rpc = JsonRpcRouter(notification_queue_size=10**7)
+
+    @rpc.post()
+    class Echo(BaseModel):
+        msg: str
+
+        def __call__(self):
+            return self.msg
+
+    @rpc.post()
+    class Add(BaseModel):
+        a: int
+        b: int
+
+        async def __call__(self):
+            return self.a + self.b
+
+    app = FastAPI()
+    app.include_router(rpc, prefix=PATH[:-1])
+    return app, rpc
+
+
+def request(method, params, id=None):
+    req = {"jsonrpc": "2.0", "method": method, "params": params}
+    if id is not None:
+        req["id"] = id
+    return req
+
+
+def http_scenario(body) -> Setup:
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+
+    async def setup():
+        app, rpc = create_app()
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": PATH,
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"content-type", b"application/json")],
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                assert message["status"] in (200, 204), message
+
+        async def call():
+            await app(dict(scope), receive, send)
+
+        async def teardown():
+            await rpc.notifications.join()
+
+        return call, teardown
+
+    return setup
+
+
+def websocket_scenario(body) -> Setup:
+    text = json.dumps(body)
+
+    async def setup():
+        app, rpc = create_app()
+        inbox: asyncio.Queue = asyncio.Queue()
+        outbox: asyncio.Queue = asyncio.Queue()
+        scope = {"type": "websocket", "app": app, "router": app.router}
+        websocket = JsonRpcWebSocket(scope, inbox.get, outbox.put, rpc)
+        websocket.client_state = WebSocketState.CONNECTED
+        websocket.application_state = WebSocketState.CONNECTED
+        task = asyncio.create_task(websocket.serve())
+
+        async def call():
+            await inbox.put({"type": "websocket.receive", "text": text})
+            await outbox.get()
+
+        async def teardown():
+            await inbox.put({"type": "websocket.disconnect", "code": 1000})
+            await task
+
+        return call, teardown
+
+    return setup
+
+
+def batch(size):
+    return [request("echo", {"msg": "hello"}, id=i) for i in range(size)]
+
+
+SCENARIOS: Dict[str, Setup] = {
+    "http_single": http_scenario(request("echo", {"msg": "hello"}, id=1)),
+    "http_single_async": http_scenario(request("add", {"a": 1, "b": 2}, id=1)),
+    "http_notification": http_scenario(request("echo", {"msg": "hello"})),
+    "http_batch_10": http_scenario(batch(10)),
+    "http_batch_100": http_scenario(batch(100)),
+    "http_parse_error": http_scenario(b'{"jsonrpc": "2.0", '),
+    "http_method_not_found": http_scenario(request("xxx", {}, id=1)),
+    "http_invalid_params": http_scenario(request("echo", {}, id=1)),
+    "websocket_single": websocket_scenario(request("echo", {"msg": "hello"}, id=1)),
+    "websocket_batch_10": websocket_scenario(batch(10)),
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q))
+    return sorted_values[index]
+
+
+async def measure(setup: Setup, iterations: int, warmup: int, alloc_iterations: int):
+    call, teardown = await setup()
+    try:
+        for _ in range(warmup):
+            await call()
+
+        latencies = []
+        perf_counter = time.perf_counter
+        started = perf_counter()
+        for _ in range(iterations):
+            t = perf_counter()
+            await call()
+            latencies.append(perf_counter() - t)
+        elapsed = perf_counter() - started
+
+        allocated = 0
+        for _ in range(alloc_iterations):
+            tracemalloc.start()
+            await call()
+            allocated += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        await teardown()
+
+    latencies.sort()
+    return {
+        "ops_per_sec": iterations / elapsed,
+        "p50_us": percentile(latencies, 0.50) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "peak_bytes": allocated // max(alloc_iterations, 1),
+    }
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    """Medians of repeated runs, and the spread of ops/sec relative to the median."""
+    ops = [r["ops_per_sec"] for r in runs]
+    median = statistics.median(ops)
+    return {
+        "ops_per_sec": round(median, 1),
+        "spread": round((max(ops) - min(ops)) / median, 3),
+        "p50_us": round(statistics.median(r["p50_us"] for r in runs), 1),
+        "p99_us": round(statistics.median(r["p99_us"] for r in runs), 1),
+        "peak_bytes": int(statistics.median(r["peak_bytes"] for r in runs)),
+    }
+
+
+def run(
+    names: List[str],
+    iterations: int = 2000,
+    warmup: int = 200,
+    alloc_iterations=50,
+    repeat: int = 5,
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in names:
+        runs = [
+            asyncio.run(measure(SCENARIOS[name], iterations, warmup, alloc_iterations))
+            for _ in range(repeat)
+        ]
+        results[name] = summarize(runs)
+    return results
+
+
+def machine() -> str:
+    """Identify the machine and interpreter a baseline was recorded with."""
+    return " ".join(
+        (
+            platform.node(),
+            platform.machine(),
+            platform.python_implementation(),
+            platform.python_version(),
+        )
+    )
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    """Print results and return the scenarios slower than the baseline.
+
+    The allowed slowdown of a scenario is `threshold` plus the larger spread of
+    the baseline and the current runs.
+    """
+    regressions = []
+    header = f"{'scenario':<24}{'ops/sec':>12}{'spread':>9}{'p50 us':>10}"
+    print(header + f"{'p99 us':>10}{'peak B':>10}{'vs base':>10}{'allowed':>10}")
+
+    for name, result in results.items():
+        line = (
+            f"{name:<24}{result['ops_per_sec']:>12.1f}{result['spread']:>9.1%}"
+            f"{result['p50_us']:>10.1f}{result['p99_us']:>10.1f}"
+            f"{result['peak_bytes']:>10}"
+        )
+        base = baseline.get(name)
+        if base:
+            ratio = result["ops_per_sec"] / base["ops_per_sec"] - 1
+            allowed = threshold + max(base.get("spread", 0), result["spread"])
+            line += f"{ratio:>+10.1%}{-allowed:>+10.1%}"
+            if ratio < -allowed:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    """Scenarios of the baseline at `path`, or nothing if it is of another machine."""
+    if not os.path.exists(path):
+        print(f"No baseline at {path}. Record one with --save.")
+        return {}
+
+    with open(path) as f:
+        baseline = json.load(f)
+
+    recorded = baseline.get("machine", None)
+    if recorded != machine():
+        # 別のマシンの結果とは比較できないため、比較を省く
+        print(f"The baseline was recorded on {recorded!r}, not {machine()!r}.")
+        print("Comparisons are skipped. Record a baseline here with --save.")
+        return {}
+    return baseline["scenarios"]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="keyword", default="", help="filter scenarios")
+    parser.add_argument("-n", "--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--alloc-iterations", type=int, default=50)
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs per scenario (default: 5)"
+    )
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="update the baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="allowed ops/sec regression ratio on top of the spread (default: 0.1)",
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="exit with 1 when a regression is found"
+    )
+    args = parser.parse_args(argv)
+
+    if args.repeat < 1:
+        parser.error("--repeat must be greater than 0")
+
+    names = [name for name in SCENARIOS if args.keyword in name]
+    results = run(
+        names, args.iterations, args.warmup, args.alloc_iterations, args.repeat
+    )
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"machine": machine(), "scenarios": baseline},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+
+    if args.check and regressions:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+class CachedResult:
+    """A cached result. The encoded `result` member is kept once it is built.
+
+    Encodings are kept per codec format, as websocket connections may negotiate a
+    binary format.
+    """
+
+    __slots__ = ("value", "encoded")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.encoded: Dict[str, bytes] = {}
+
+    async def encode(self, jsonalize, codec) -> bytes:
+        encoded = self.encoded.get(codec.format, None)
+        if encoded is None:
+            encoded = codec.dumps(await jsonalize(self.value))
+            self.encoded[codec.format] = encoded
+        return encoded
+
+
+def params_key(method: str, params: BaseModel) -> Tuple[str, bytes]:
+    """Key a call by method name and a hash of its canonical params."""
+    canonical = params.json(sort_keys=True, separators=(",", ":"))
+    return method, hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+class ResultCache:
+    """Cache results of methods that are pure functions of their params.
+
+    At most `maxsize` results are kept, the least recently used is evicted first,
+    and results expire after `ttl` seconds (never if None). Concurrent calls with
+    the same key share one execution. Errors are not cached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        if maxsize < 1:
+            raise ValueError("'maxsize' must be greater than 0.")
+
+        if ttl is not None and ttl <= 0:
+            raise ValueError("'ttl' must be greater than 0.")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Optional[float], Any]]"
+        self._entries = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return False, None
+
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_call(self, key: Hashable, func: Callable[[], Awaitable]) -> Any:
+        while True:
+            found, value = self.get(key)
+            if found:
+                self.hits += 1
+                return value
+
+            # 実行中の同じ呼び出しがあれば、その結果を待つ
+            future = self._inflight.get(key, None)
+            if future is None:
+                break
+
+            await asyncio.wait({future})
+            # 実行していた呼び出しが取り消された場合は、待機者が実行し直す
+            if not future.cancelled():
+                self.hits += 1
+                return future.result()
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # 待機者がいない場合に例外が未取得と警告されないようにする
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            value = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+        finally:
+            del self._inflight[key]
+
+        return value
@@ -0,0 +1,632 @@
+import asyncio
+import itertools
+import logging
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from . import exceptions
+from .codec import JsonCodec, get_codec
+from .handler import RpcSession, empty_receive
+from .schemas import RpcRequest, RpcRequestBatch, RpcRequestNotification
+from .websocket import JsonRpcWebSocket
+
+if TYPE_CHECKING:
+    from .router import JsonRpcRouter
+
+logger = logging.getLogger(__name__)
+
+Call = Tuple[str, Dict[str, Any]]
+
+
+def create_request(method: str, params: Dict[str, Any], id: Optional[int] = None):
+    """Build a request. Without `id`, a notification is built."""
+    request = {"jsonrpc": "2.0", "method": method, "params": params}
+    if id is not None:
+        request["id"] = id
+    return request
+
+
+def get_result(response: Dict[str, Any]) -> Any:
+    """Return the result of a response, or raise the exception of its error."""
+    if "error" in response:
+        raise exceptions.RpcBaseError.from_dict(response["error"])
+    return response.get("result", None)
+
+
+class BaseRpcClient:
+    """Call json rpc methods with `call`, `notify` and `batch`.
+
+    Results are returned decoded and errors are raised as the `RpcBaseError`
+    subclass registered for their code.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    async def call(self, method: str, **params) -> Any:
+        raise NotImplementedError()
+
+    async def notify(self, method: str, **params) -> None:
+        raise NotImplementedError()
+
+    async def batch(self, calls: Iterable[Call]) -> List[Any]:
+        """Call `(method, params)` pairs at once.
+
+        Results are returned in order, with errors in place of failed calls.
+        """
+        raise NotImplementedError()
+
+
+class LocalRpcClient(BaseRpcClient):
+    """Call the methods of a router in process.
+
+    Requests are validated with a cached session and methods are called directly,
+    so no http request is built and results are never encoded.
+
+        client = rpc.get_client(app)
+        await client.call("echo", msg="hello")
+    """
+
+    def __init__(self, app, rpc_router):
+        super().__init__()
+        scope = {"type": "http", "app": app, "router": app.router}
+        self.route = JsonRpcWebSocket._find_entrypoint(rpc_router, scope)
+        entrypoint = JsonRpcWebSocket._analize_entrypoint_path(scope, rpc_router)
+        self._rpc_scope = JsonRpcWebSocket._create_rpc_scope(scope, entrypoint)
+        self._session = RpcSession(self.route._handlers, self.route.path)
+
+    @staticmethod
+    def get_client(self: "JsonRpcRouter", app) -> "LocalRpcClient":
+        return LocalRpcClient(app, self)
+
+    async def request(self, body: Dict[str, Any]) -> Any:
+        async with AsyncExitStack() as stack:
+            scope = dict(self._rpc_scope)
+            scope["fastapi_astack"] = stack
+            result, background = await self.route.invoke(
+                scope, empty_receive, body, self._session
+            )
+
+        if background is not None:
+            await background()
+
+        return result
+
+    async def call(self, method: str, **params) -> Any:
+        return await self.request(create_request(method, params, self.next_id()))
+
+    async def notify(self, method: str, **params) -> None:
+        await self.request(create_request(method, params))
+
+    async def batch(self, calls: Iterable[Call]) -> List[Any]:
+        concurrency = self.route._batch_concurrency
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+        async def execute(method, params):
+            try:
+                if semaphore is None:
+                    return await self.call(method, **params)
+                async with semaphore:
+                    return await self.call(method, **params)
+            except exceptions.RpcBaseError as e:
+                return e
+
+        return await asyncio.gather(*(execute(*call) for call in calls))
+
+
+class HttpRpcClient(BaseRpcClient):
+    """Call json rpc methods of an upstream over http with `httpx`.
+
+    One `httpx.AsyncClient` keeps up to `max_connections` keep-alive connections
+    to the upstream, so share the client between callers. With `batch_window`,
+    calls and notifications made within that many seconds (0 for the same event
+    loop iteration) are sent as one batch, up to `max_batch_size` requests each.
+    Other keyword arguments are passed to `httpx.AsyncClient`.
+
+        async with HttpRpcClient("http://localhost:8000/", batch_window=0.005) as client:
+            await asyncio.gather(client.call("echo", msg="a"), client.call("echo", msg="b"))
+    """
+
+    def __init__(
+        self,
+        url: str,
+        batch_window: Optional[float] = None,
+        max_batch_size: int = 100,
+        max_connections: int = 10,
+        codec: Optional[Union[str, JsonCodec]] = None,
+        **kwargs,
+    ):
+        import httpx
+
+        if batch_window is not None and batch_window < 0:
+            raise ValueError("'batch_window' must be 0 or greater.")
+
+        if max_batch_size < 1:
+            raise ValueError("'max_batch_size' must be greater than 0.")
+
+        super().__init__()
+        self.url = url
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.codec = get_codec(codec)
+        kwargs.setdefault(
+            "limits",
+            httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self._client = httpx.AsyncClient(**kwargs)
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def __aenter__(self) -> "HttpRpcClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Send pending calls, wait for them and close the connections."""
+        self.flush()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+    async def post(self, payload: Any) -> Any:
+        response = await self._client.post(
+            self.url,
+            content=self.codec.dumps(payload),
+            headers={"content-type": "application/json"},
+        )
+        if response.status_code == 204:
+            return None
+        response.raise_for_status()
+        try:
+            return self.codec.loads(response.content)
+        except Exception as e:
+            raise exceptions.ParseError(str(e)) from e
+
+    async def call(self, method: str, **params) -> Any:
+        request = RpcRequest.construct(method=method, params=params, id=self.next_id())
+        if self.batch_window is None:
+            return get_result(await self.post(request.dict()))
+        return await self.enqueue(request)
+
+    async def notify(self, method: str, **params) -> None:
+        request = RpcRequestNotification.construct(method=method, params=params)
+        if self.batch_window is None:
+            await self.post(request.dict())
+            return
+        await self.enqueue(request)
+
+    async def batch(self, calls: Iterable[Call]) -> List[Any]:
+        requests = [
+            RpcRequest.construct(method=method, params=params, id=self.next_id())
+            for method, params in calls
+        ]
+        if not requests:
+            return []
+
+        loop = asyncio.get_running_loop()
+        pending = [(request, loop.create_future()) for request in requests]
+        await self.send_batch(pending)
+
+        results = []
+        for _, future in pending:
+            error = future.exception()
+            if error is not None and not isinstance(error, exceptions.RpcBaseError):
+                raise error
+            results.append(future.result() if error is None else error)
+        return results
+
+    def enqueue(self, request) -> asyncio.Future:
+        """Queue a request to send with the next batch and return its future."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """Send the queued requests now."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        task = asyncio.create_task(self.send_batch(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def send_batch(self, pending: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Send requests as one batch and resolve their futures."""
+        try:
+            if len(pending) == 1:
+                responses = await self.post(pending[0][0].dict())
+            else:
+                batch = RpcRequestBatch.construct(__root__=[x for x, _ in pending])
+                responses = await self.post(batch.dict()["__root__"])
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if not isinstance(responses, list):
+            responses = [] if responses is None else [responses]
+        by_id = {
+            response.get("id", None): response
+            for response in responses
+            if isinstance(response, dict)
+        }
+        # idを特定できなかったエラー(解析エラーなど)は全ての呼び出しの失敗とする
+        shared = by_id.get(None, None)
+
+        for request, future in pending:
+            if future.done():
+                continue
+            id = getattr(request, "id", None)
+            if id is None:
+                future.set_result(None)
+                continue
+            response = by_id.get(id, shared)
+            if response is None:
+                error = exceptions.InvalidRequestError(f"No response for id {id}.")
+                future.set_exception(error)
+                continue
+            try:
+                future.set_result(get_result(response))
+            except exceptions.RpcBaseError as e:
+                future.set_exception(e)
+
+
+class ASGIWebSocketConnection:
+    """A websocket connection to an ASGI application running in memory."""
+
+    def __init__(self, app, scope):
+        self.app = app
+        self.scope = scope
+        self.subprotocol: Optional[str] = None
+        self.closed = False
+        self._to_app: asyncio.Queue = asyncio.Queue()
+        self._from_app: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        await self._to_app.put({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self._run())
+        message = await self._from_app.get()
+        if message["type"] != "websocket.accept":
+            self.closed = True
+            raise ConnectionError("The websocket was not accepted.")
+        self.subprotocol = message.get("subprotocol", None)
+
+    async def _run(self) -> None:
+        try:
+            await self.app(self.scope, self._to_app.get, self._from_app.put)
+        finally:
+            await self._from_app.put({"type": "websocket.close", "code": 1006})
+
+    async def send(self, data: Union[str, bytes]) -> None:
+        if self.closed:
+            raise ConnectionError("The websocket is closed.")
+        key = "bytes" if isinstance(data, bytes) else "text"
+        await self._to_app.put({"type": "websocket.receive", key: data})
+
+    async def recv(self) -> Union[str, bytes]:
+        message = await self._from_app.get()
+        if message["type"] == "websocket.close":
+            self.closed = True
+            raise ConnectionError("The websocket is closed.")
+        return message.get("text", None) or message.get("bytes", b"")
+
+    async def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            await self._to_app.put({"type": "websocket.disconnect", "code": 1000})
+        # 受信を待っている側に切断を伝える
+        await self._from_app.put({"type": "websocket.close", "code": 1000})
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class ASGIWebSocketTransport:
+    """Open websocket connections to an ASGI application in memory.
+
+    Pass it as `connect` of `WebSocketRpcClient` to test against the app.
+    """
+
+    def __init__(self, app, path: str = "/", subprotocols: Iterable[str] = ()):
+        self.app = app
+        self.path = path
+        self.subprotocols = list(subprotocols)
+
+    async def __call__(self) -> ASGIWebSocketConnection:
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("testserver", 80),
+            "subprotocols": self.subprotocols,
+        }
+        connection = ASGIWebSocketConnection(self.app, scope)
+        await connection.open()
+        return connection
+
+
+class WebSocketRpcClient(BaseRpcClient):
+    """Call json rpc methods over one persistent websocket connection.
+
+    Calls are sent as soon as they are made and their responses are matched by id,
+    so many calls run concurrently; at most `max_in_flight` frames wait for a
+    response at once and further calls wait for a free slot. Streamed results are
+    returned as a list of their partial items.
+
+    `connect` is a url (connected with the `websockets` package) or a coroutine
+    function returning a connection with `send`, `recv` and `close`. When the
+    connection is lost, calls waiting for a response fail with `ConnectionError`
+    and, with `reconnect`, the client connects again after `backoff` seconds,
+    doubled up to `max_backoff` while connecting fails. New calls wait for the
+    connection. With `timeout`, calls not answered within that many seconds raise
+    `asyncio.TimeoutError`.
+
+        async with WebSocketRpcClient("ws://localhost:8000/ws") as client:
+            await client.call("echo", msg="hello")
+    """
+
+    def __init__(
+        self,
+        connect: Union[str, Callable[[], Awaitable[Any]]],
+        max_in_flight: int = 100,
+        reconnect: bool = True,
+        backoff: float = 0.1,
+        max_backoff: float = 10.0,
+        codec: Optional[Union[str, JsonCodec]] = None,
+        timeout: Optional[float] = None,
+    ):
+        if max_in_flight < 1:
+            raise ValueError("'max_in_flight' must be greater than 0.")
+
+        if timeout is not None and timeout <= 0:
+            raise ValueError("'timeout' must be greater than 0.")
+
+        if backoff <= 0 or max_backoff < backoff:
+            raise ValueError("'backoff' must be greater than 0 and <= 'max_backoff'.")
+
+        super().__init__()
+        if isinstance(connect, str):
+            connect = partial(connect_websocket, connect)
+        self._connect = connect
+        self.max_in_flight = max_in_flight
+        self.reconnect = reconnect
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.codec = get_codec(codec)
+        self.timeout = timeout
+        self.connection = None
+        self.connects = 0
+        self.in_flight = 0
+        self._window: Optional[asyncio.Semaphore] = None
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._partials: Dict[int, List[Any]] = {}
+        self._connected: Optional[asyncio.Event] = None
+        self._error: Optional[Exception] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def __aenter__(self) -> "WebSocketRpcClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """Connect if not connected yet and wait for the connection."""
+        await self.get_connection()
+
+    def _create_primitives(self) -> None:
+        # Python 3.9以前は生成時のイベントループに結び付くため、実行中のループで作る
+        if self._window is None:
+            self._window = asyncio.Semaphore(self.max_in_flight)
+            self._connected = asyncio.Event()
+
+    async def close(self) -> None:
+        self._closed = True
+        if self.connection is not None:
+            await self.connection.close()
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+        self._fail(ConnectionError("The client is closed."))
+
+    async def get_connection(self):
+        self._create_primitives()
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+        await self._connected.wait()
+        if self._error is not None:
+            raise self._error
+        return self.connection
+
+    async def _run(self) -> None:
+        delay = self.backoff
+        while not self._closed:
+            try:
+                self.connection = await self._connect()
+            except Exception as e:
+                if not self.reconnect:
+                    self._fail(e)
+                    return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+
+            delay = self.backoff
+            self.connects += 1
+            self._connected.set()
+            connection = self.connection
+            try:
+                await self._receive(connection)
+            except Exception as e:
+                if not self._closed:
+                    logger.warning("Websocket rpc connection lost: %r", e)
+            self._connected.clear()
+            # 受信できなくなった接続は閉じてから接続し直す
+            try:
+                await connection.close()
+            except Exception as e:
+                logger.debug("Failed to close websocket rpc connection: %r", e)
+            # 送信済みの呼び出しは実行されたか分からないため、再送せずに失敗とする
+            self._fail_pending(ConnectionError("The websocket is disconnected."))
+            if not self.reconnect:
+                self._fail(ConnectionError("The websocket is disconnected."))
+                return
+            # すぐに切断するサーバーに接続し続けないよう、再接続の前にも待つ
+            if not self._closed:
+                await asyncio.sleep(delay)
+
+    async def _receive(self, connection) -> None:
+        while True:
+            data = await connection.recv()
+            try:
+                message = self.codec.loads(data)
+                responses = message if isinstance(message, list) else [message]
+                if not all(isinstance(x, dict) for x in responses):
+                    raise ValueError("responses must be objects.")
+            except Exception as e:
+                # 不正なフレームはどの呼び出しへの応答か分からないため、全て失敗とする
+                logger.error("Malformed websocket rpc frame: %r", e)
+                self._fail_pending(exceptions.ParseError(str(e)))
+                continue
+
+            for response in responses:
+                id = response.get("id", None)
+                if id is None and "error" in response:
+                    # どの呼び出しへの応答か分からないエラー(解析エラーなど)は、
+                    # 応答待ちの呼び出しを全て失敗とする
+                    self._fail_pending(
+                        exceptions.RpcBaseError.from_dict(response["error"])
+                    )
+                    continue
+                future = self._futures.get(id, None)
+                if future is None or future.done():
+                    continue
+                if "partial" in response:
+                    self._partials.setdefault(id, []).append(response["partial"])
+                else:
+                    future.set_result(response)
+
+    def _fail_pending(self, error: Exception) -> None:
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _fail(self, error: Exception) -> None:
+        self._error = error
+        if self._connected is not None:
+            self._connected.set()
+        self._fail_pending(error)
+
+    async def send(self, content: Any) -> None:
+        connection = await self.get_connection()
+        await connection.send(self.codec.dumps(content).decode())
+
+    def _get_result(self, id: int, response: Dict[str, Any]) -> Any:
+        result = get_result(response)
+        partials = self._partials.pop(id, None)
+        return result if partials is None else partials
+
+    def _discard(self, id: int) -> None:
+        future = self._futures.pop(id, None)
+        self._partials.pop(id, None)
+        # 送信に失敗した場合など、取得されなかった例外を警告させない
+        if future is not None and future.done() and not future.cancelled():
+            future.exception()
+
+    async def call(self, method: str, **params) -> Any:
+        self._create_primitives()
+        async with self._window:
+            id = self.next_id()
+            future = asyncio.get_running_loop().create_future()
+            self._futures[id] = future
+            self.in_flight += 1
+            try:
+                await self.send(create_request(method, params, id))
+                response = await asyncio.wait_for(future, self.timeout)
+                return self._get_result(id, response)
+            finally:
+                self.in_flight -= 1
+                self._discard(id)
+
+    async def notify(self, method: str, **params) -> None:
+        await self.send(create_request(method, params))
+
+    async def batch(self, calls: Iterable[Call]) -> List[Any]:
+        calls = list(calls)
+        if not calls:
+            return []
+
+        self._create_primitives()
+        async with self._window:
+            loop = asyncio.get_running_loop()
+            ids = [self.next_id() for _ in calls]
+            for id in ids:
+                self._futures[id] = loop.create_future()
+            self.in_flight += 1
+            try:
+                await self.send(
+                    [
+                        create_request(method, params, id)
+                        for (method, params), id in zip(calls, ids)
+                    ]
+                )
+                return await asyncio.wait_for(self._get_results(ids), self.timeout)
+            finally:
+                self.in_flight -= 1
+                for id in ids:
+                    self._discard(id)
+
+    async def _get_results(self, ids: List[int]) -> List[Any]:
+        results = []
+        for id in ids:
+            try:
+                results.append(self._get_result(id, await self._futures[id]))
+            except exceptions.RpcBaseError as e:
+                results.append(e)
+        return results
+
+
+async def connect_websocket(url: str):
+    import websockets
+
+    return await websockets.connect(url)
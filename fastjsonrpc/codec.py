@@ -0,0 +1,264 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Type, Union
+
+
+class JsonCodec:
+    """Encode and decode json with the standard library."""
+
+    name = "json"
+    # 同じ形式のコーデックは互いのエンコード結果を再利用できる
+    format = "json"
+    binary = False
+
+    def loads(self, data: Union[bytes, bytearray, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(self, content: Any) -> bytes:
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    def render_response(self, result: bytes, id: Optional[int] = None) -> bytes:
+        """Build the RpcResponse envelope around an encoded result."""
+        return render_rpc_response(result, id)
+
+    def render_partial(self, item: bytes, id: Optional[int] = None) -> bytes:
+        """Build a partial result frame of a streamed result."""
+        return render_rpc_partial(item, id)
+
+    def render_batch(self, contents: List[bytes]) -> bytes:
+        return b"[" + b",".join(contents) + b"]"
+
+    def render_error(self, err, id: Optional[int] = None) -> bytes:
+        return err.render(id, self.dumps)
+
+
+# 64ビットを超えうる整数。高速なライブラリが正しく扱えないため標準ライブラリで読み直す
+_BIG_INT = re.compile(rb"\d{20}")
+
+
+def has_big_int(data: Union[bytes, bytearray, str]) -> bool:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return _BIG_INT.search(data) is not None
+
+
+class OrjsonCodec(JsonCodec):
+    """Encode and decode json with orjson.
+
+    orjson decodes integers over 64 bits as floats, so documents with an integer
+    of 20 or more digits are decoded with the standard library instead. Invalid
+    documents raise orjson's `JSONDecodeError` (a subclass of
+    `json.JSONDecodeError`) without being parsed again.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def loads(self, data: Union[bytes, bytearray, str]) -> Any:
+        # 解析に成功しても、大きな整数は精度を失ったfloatになっている
+        content = self._orjson.loads(data)
+        if has_big_int(data):
+            return super().loads(data)
+        return content
+
+    def dumps(self, content: Any) -> bytes:
+        try:
+            return self._orjson.dumps(content)
+        except self._orjson.JSONEncodeError:
+            return super().dumps(content)
+
+
+class UjsonCodec(JsonCodec):
+    """Encode and decode json with ujson.
+
+    Integers ujson can't handle fall back to the standard library. Other invalid
+    documents raise `json.JSONDecodeError` without being parsed again.
+    """
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+
+        self._ujson = ujson
+
+    def loads(self, data: Union[bytes, bytearray, str]) -> Any:
+        # ujsonはbytearrayを受け付けない
+        if isinstance(data, bytearray):
+            data = bytes(data)
+        try:
+            return self._ujson.loads(data)
+        except ValueError as e:
+            if not has_big_int(data):
+                # 呼び出し側は標準ライブラリの例外で解析エラーを判定する
+                doc = data if isinstance(data, str) else data.decode("utf-8", "replace")
+                raise json.JSONDecodeError(str(e), doc, 0) from e
+            return super().loads(data)
+
+    def dumps(self, content: Any) -> bytes:
+        try:
+            return self._ujson.dumps(
+                content, ensure_ascii=False, escape_forward_slashes=False
+            ).encode("utf-8")
+        except (TypeError, OverflowError):
+            return super().dumps(content)
+
+
+class BinaryCodec(JsonCodec):
+    """Base of binary encodings of the json rpc envelope.
+
+    The envelope is a map of the same members as json, so responses are built by
+    concatenating the encoded result with encoded keys, as with `JsonCodec`.
+    Binary codecs are negotiated per websocket connection and are not used for http.
+    """
+
+    binary = True
+
+    def __init__(self):
+        self._response_prefix = self._envelope_prefix("result")
+        self._partial_prefix = self._envelope_prefix("partial")
+        self._id_key = self.dumps("id")
+
+    def _envelope_prefix(self, key: str) -> bytes:
+        return (
+            self._map_header(3)
+            + self.dumps("jsonrpc")
+            + self.dumps("2.0")
+            + (self.dumps(key))
+        )
+
+    def _map_header(self, size: int) -> bytes:
+        raise NotImplementedError()
+
+    def _array_header(self, size: int) -> bytes:
+        raise NotImplementedError()
+
+    def render_response(self, result: bytes, id: Optional[int] = None) -> bytes:
+        return self._response_prefix + result + self._id_key + self.dumps(id)
+
+    def render_partial(self, item: bytes, id: Optional[int] = None) -> bytes:
+        return self._partial_prefix + item + self._id_key + self.dumps(id)
+
+    def render_batch(self, contents: List[bytes]) -> bytes:
+        return self._array_header(len(contents)) + b"".join(contents)
+
+    def render_error(self, err, id: Optional[int] = None) -> bytes:
+        return self.dumps(err.to_dict(id=id))
+
+
+class MsgpackCodec(BinaryCodec):
+    """Encode and decode MessagePack with msgpack."""
+
+    name = "msgpack"
+    format = "msgpack"
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+        super().__init__()
+
+    def loads(self, data: Union[bytes, bytearray, str]) -> Any:
+        return self._msgpack.unpackb(data, raw=False)
+
+    def dumps(self, content: Any) -> bytes:
+        return self._msgpack.packb(content, use_bin_type=True)
+
+    def _map_header(self, size: int) -> bytes:
+        return self._msgpack.Packer().pack_map_header(size)
+
+    def _array_header(self, size: int) -> bytes:
+        return self._msgpack.Packer().pack_array_header(size)
+
+
+class CborCodec(BinaryCodec):
+    """Encode and decode CBOR with cbor2."""
+
+    name = "cbor"
+    format = "cbor"
+
+    def __init__(self):
+        import cbor2
+
+        self._cbor2 = cbor2
+        super().__init__()
+
+    def loads(self, data: Union[bytes, bytearray, str]) -> Any:
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        return self._cbor2.loads(data)
+
+    def dumps(self, content: Any) -> bytes:
+        return self._cbor2.dumps(content)
+
+    def _map_header(self, size: int) -> bytes:
+        return cbor_head(5, size)
+
+    def _array_header(self, size: int) -> bytes:
+        return cbor_head(4, size)
+
+
+def cbor_head(major: int, size: int) -> bytes:
+    """Encode the initial bytes of a CBOR item of `major` type with `size` members."""
+    if size < 24:
+        return bytes((major << 5 | size,))
+    for info, length in ((24, 1), (25, 2), (26, 4), (27, 8)):
+        if size < 1 << (length * 8):
+            return bytes((major << 5 | info,)) + size.to_bytes(length, "big")
+    raise ValueError("CBOR item is too large.")
+
+
+def encode_id(id: Optional[int]) -> bytes:
+    return b"null" if id is None else str(id).encode()
+
+
+def render_rpc_response(result: bytes, id: Optional[int] = None) -> bytes:
+    """Build the json RpcResponse envelope around an encoded result."""
+    return b'{"jsonrpc":"2.0","result":' + result + b',"id":' + encode_id(id) + b"}"
+
+
+def render_rpc_partial(item: bytes, id: Optional[int] = None) -> bytes:
+    """Build a json partial result frame of a streamed result."""
+    return b'{"jsonrpc":"2.0","partial":' + item + b',"id":' + encode_id(id) + b"}"
+
+
+CODECS: Dict[str, Type[JsonCodec]] = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    UjsonCodec.name: UjsonCodec,
+}
+
+# websocketのサブプロトコルで選ばれるバイナリ形式
+BINARY_CODECS: Dict[str, Type[BinaryCodec]] = {
+    "jsonrpc.msgpack": MsgpackCodec,
+    "jsonrpc.cbor": CborCodec,
+}
+
+
+def get_codec(codec: Optional[Union[str, JsonCodec]] = None) -> JsonCodec:
+    """Return a codec instance. orjson is used by default when it is installed."""
+    if codec is None:
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return JsonCodec()
+
+    if isinstance(codec, str):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        return CODECS[codec]()
+
+    if not isinstance(codec, JsonCodec):
+        raise TypeError("codec must be str or JsonCodec.")
+
+    return codec
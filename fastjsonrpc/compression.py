@@ -0,0 +1,255 @@
+import gzip
+import zlib
+from typing import Dict, Optional, Sequence
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+# Z_SYNC_FLUSHの末尾。permessage-deflateと同様に送信時に取り除く
+_SYNC_TAIL = b"\x00\x00\xff\xff"
+
+
+class DeflateCompressor:
+    """Compress the messages of one connection as permessage-deflate does.
+
+    One raw deflate context is kept for the whole connection, so later messages
+    refer to earlier ones. Each message is flushed and sent without the trailing
+    `00 00 ff ff`. Decode them with `DeflateDecompressor`.
+    """
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = self._compressor.compress(data)
+        compressed += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        compressed = compressed[: -len(_SYNC_TAIL)]
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return compressed
+
+
+class DeflateDecompressor:
+    """Decode messages of a `DeflateCompressor` in the order they were sent."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data + _SYNC_TAIL)
+
+
+class CompressionMetrics:
+    def __init__(self):
+        self.messages = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, size: int, sent: int, compressed: bool) -> None:
+        self.messages += 1
+        self.bytes_in += size
+        self.bytes_out += sent
+        if compressed:
+            self.compressed += 1
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "messages": self.messages,
+            "compressed": self.compressed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+        }
+
+
+class WebSocketCompression(CompressionMetrics):
+    """Compress large websocket responses of clients requesting `jsonrpc.deflate`.
+
+    Messages of at least `threshold` bytes are sent as binary frames compressed with
+    a context kept per connection, smaller ones as plain text frames. With
+    `respect_permessage_deflate`, clients that offered the permessage-deflate
+    extension are not compressed again by the application.
+    """
+
+    SUBPROTOCOL = "jsonrpc.deflate"
+
+    def __init__(
+        self,
+        threshold: int = 1024,
+        level: int = 6,
+        respect_permessage_deflate: bool = True,
+    ):
+        if threshold < 0:
+            raise ValueError("'threshold' must be 0 or greater.")
+
+        if not -1 <= level <= 9:
+            raise ValueError("'level' must be between -1 and 9.")
+
+        super().__init__()
+        self.threshold = threshold
+        self.level = level
+        self.respect_permessage_deflate = respect_permessage_deflate
+
+    def accepts(self, scope) -> bool:
+        """Whether the connection may negotiate `SUBPROTOCOL`."""
+        if not self.respect_permessage_deflate:
+            return True
+
+        for key, value in scope.get("headers", []):
+            if key == b"sec-websocket-extensions" and b"permessage-deflate" in value:
+                return False
+        return True
+
+    def create_compressor(self) -> DeflateCompressor:
+        return DeflateCompressor(self.level)
+
+    def compress(self, compressor: DeflateCompressor, data: bytes) -> Optional[bytes]:
+        """Compress `data` if it is large enough. Returns None to send it as is."""
+        if len(data) < self.threshold:
+            self.record(len(data), len(data), False)
+            return None
+
+        # 文脈を共有するため、一度圧縮したメッセージは大きくなっても圧縮したまま送る
+        compressed = compressor.compress(data)
+        self.record(len(data), len(compressed), True)
+        return compressed
+
+
+class HttpCompression(CompressionMetrics):
+    """Compress http responses with the best encoding accepted by the client.
+
+    `encodings` are tried in order of preference among those the client accepts
+    with the highest quality; `br` and `zstd` are skipped unless `brotli` and
+    `zstandard` are installed. Responses smaller than `threshold` and streamed
+    responses are sent as is. Bodies of at least `thread_threshold` bytes are
+    compressed in a worker thread.
+    """
+
+    ENCODINGS = ("zstd", "br", "gzip")
+    LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+    def __init__(
+        self,
+        threshold: int = 1024,
+        encodings: Sequence[str] = ENCODINGS,
+        levels: Optional[Dict[str, int]] = None,
+        thread_threshold: int = 1 << 16,
+    ):
+        super().__init__()
+        if threshold < 0:
+            raise ValueError("'threshold' must be 0 or greater.")
+
+        self.threshold = threshold
+        self.thread_threshold = thread_threshold
+        self.levels = {**self.LEVELS, **(levels or {})}
+        self._compressors = {}
+        for encoding in encodings:
+            if encoding not in self.LEVELS:
+                raise ValueError(f"Unknown encoding: {encoding}")
+            try:
+                self._compressors[encoding] = self._create_compressor(encoding)
+            except ImportError:
+                continue
+
+    @property
+    def encodings(self) -> Sequence[str]:
+        return tuple(self._compressors)
+
+    def _create_compressor(self, encoding: str):
+        level = self.levels[encoding]
+        if encoding == "br":
+            import brotli
+
+            return lambda data: brotli.compress(data, quality=level)
+
+        if encoding == "zstd":
+            import zstandard
+
+            # ZstdCompressorはスレッド間で共有できないため、呼び出しごとに作る
+            return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+
+        return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+
+    def negotiate(self, scope) -> Optional[str]:
+        """Return the encoding to use for the request, or None."""
+        accept = Headers(scope=scope).get("accept-encoding", None)
+        if not accept:
+            return None
+
+        qualities: Dict[str, float] = {}
+        for item in accept.split(","):
+            name, _, params = item.partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    continue
+            qualities[name.strip().lower()] = quality
+
+        best, best_quality = None, 0.0
+        for encoding in self._compressors:
+            quality = qualities.get(encoding, qualities.get("*", 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        return self._compressors[encoding](data)
+
+    async def encode(self, data: bytes, encoding: str) -> bytes:
+        if len(data) >= self.thread_threshold:
+            compressed = await run_in_threadpool(self.compress, data, encoding)
+        else:
+            compressed = self.compress(data, encoding)
+        self.record(len(data), len(compressed), True)
+        return compressed
+
+
+class CompressingSend:
+    """Wrap an ASGI `send` to compress a response sent in one body message.
+
+    The start message is held until the body is known. Set `enabled` to False
+    before the response starts to send it as is.
+    """
+
+    def __init__(self, send, compression: HttpCompression, encoding: str):
+        self.send = send
+        self.compression = compression
+        self.encoding = encoding
+        self.enabled = True
+        self._start: Optional[dict] = None
+
+    async def __call__(self, message) -> None:
+        if message["type"] == "http.response.start" and self.enabled:
+            self._start = message
+            return
+
+        if message["type"] != "http.response.body" or self._start is None:
+            await self.send(message)
+            return
+
+        start, self._start = self._start, None
+        body = message.get("body", b"")
+        headers = MutableHeaders(raw=start.setdefault("headers", []))
+        if (
+            message.get("more_body", False)
+            or len(body) < self.compression.threshold
+            or "content-encoding" in headers
+        ):
+            if not message.get("more_body", False):
+                self.compression.record(len(body), len(body), False)
+            await self.send(start)
+            await self.send(message)
+            return
+
+        body = await self.compression.encode(body, self.encoding)
+        headers["content-encoding"] = self.encoding
+        headers["content-length"] = str(len(body))
+        headers.add_vary_header("Accept-Encoding")
+        await self.send(start)
+        await self.send({"type": "http.response.body", "body": body})
@@ -0,0 +1,86 @@
+import logging
+import random
+import time
+from typing import Optional
+
+default_logger = logging.getLogger("fastjsonrpc.router")
+
+
+class ErrorLog:
+    """Log unexpected exceptions raised by methods without amplifying load.
+
+    Only `sample_rate` of errors are considered, and at most `max_per_second` of
+    them are logged (bursts of the same size are allowed). Skipped errors are
+    counted and reported with the next logged one. Nothing is formatted unless the
+    logger is enabled for `level`.
+    """
+
+    def __init__(
+        self,
+        logger: Optional[logging.Logger] = None,
+        level: int = logging.ERROR,
+        sample_rate: float = 1.0,
+        max_per_second: Optional[float] = 10,
+    ):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("'sample_rate' must be between 0 and 1.")
+
+        if max_per_second is not None and max_per_second <= 0:
+            raise ValueError("'max_per_second' must be greater than 0.")
+
+        self.logger = logger or default_logger
+        self.level = level
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._burst = max(max_per_second or 1.0, 1.0)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self.logged = 0
+        self.suppressed = 0
+
+    def _acquire(self) -> bool:
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+
+        if self.max_per_second is None:
+            return True
+
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst,
+            self._tokens + (now - self._updated) * self.max_per_second,
+        )
+        self._updated = now
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+    def log(self, e: BaseException) -> bool:
+        """Log `e` if allowed. Returns whether it was logged."""
+        if not self.logger.isEnabledFor(self.level):
+            return False
+
+        if not self._acquire():
+            self.suppressed += 1
+            return False
+
+        # starletteなど関数を実行した場所からの例外と認識してしまうため
+        # 本当の例外発生元を取得
+        tb = e.__traceback__
+        location = ""
+        if tb is not None:
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            code = tb.tb_frame.f_code
+            location = f" ({code.co_filename}:{tb.tb_lineno} in {code.co_name})"
+
+        suppressed, self.suppressed = self.suppressed, 0
+        message = f"{type(e).__name__}: {e}{location}"
+        if suppressed:
+            message += f" [{suppressed} errors suppressed]"
+
+        self.logger.log(self.level, message, exc_info=e)
+        self.logged += 1
+        return True
@@ -1,4 +1,7 @@
-from typing import Any, Optional
+import json
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel
 
 from .schemas import ErrorInfo, RpcResponseError
 
@@ -13,9 +16,66 @@ from .schemas import ErrorInfo, RpcResponseError
 
 
 class RpcBaseError(Exception):
+    _prefix: Optional[bytes] = None
+    # エラーコードごとに最初に定義されたクラス。応答のエラーを例外に戻すために使う
+    _classes: Dict[int, Type["RpcBaseError"]] = {}
+
     def __init__(self, data: Optional[Any] = None):
         self.data = data
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # codeとmessageは固定のため、エンコード済みのバイト列をクラス作成時に用意する
+        code = getattr(cls, "code", None)
+        message = getattr(cls, "message", None)
+        if isinstance(code, int):
+            RpcBaseError._classes.setdefault(code, cls)
+        if isinstance(code, int) and isinstance(message, str):
+            cls._prefix = (
+                b'{"jsonrpc":"2.0","error":{"code":'
+                + str(code).encode()
+                + b',"message":'
+                + json.dumps(message, ensure_ascii=False).encode("utf-8")
+                + b',"data":'
+            )
+        else:
+            cls._prefix = None
+
+    def render(self, id: Optional[int] = None, dumps=None) -> bytes:
+        """Encode the error response. Only `data` and `id` are encoded per call."""
+        prefix = self._prefix
+        if prefix is None or "code" in self.__dict__ or "message" in self.__dict__:
+            return (dumps or encode)(self.to_dict(id=id))
+
+        data = self.data
+        if data is None:
+            encoded_data = b"null"
+        elif isinstance(data, BaseModel):
+            encoded_data = (dumps or encode)(self.to_dict()["error"]["data"])
+        else:
+            encoded_data = (dumps or encode)(data)
+        encoded_id = b"null" if id is None else str(id).encode()
+        return prefix + encoded_data + b'},"id":' + encoded_id + b"}"
+
+    @classmethod
+    def from_dict(cls, error: Dict[str, Any]) -> "RpcBaseError":
+        """Build the exception of an `error` member of a response.
+
+        The class registered for the code is used (`RpcError` for unknown codes),
+        and a code or message different from the class is kept on the instance.
+        """
+        code = error.get("code", None)
+        message = error.get("message", None)
+        error_cls = RpcBaseError._classes.get(code, None) or RpcError
+        err = Exception.__new__(error_cls)
+        Exception.__init__(err, message)
+        err.data = error.get("data", None)
+        if code != error_cls.code:
+            err.code = code
+        if message != error_cls.message:
+            err.message = message
+        return err
+
     def to_pydantic(self, id=None):
         error = ErrorInfo(
             code=self.code,  # type: ignore
@@ -25,7 +85,21 @@ class RpcBaseError(Exception):
         return RpcResponseError(id=id, error=error)
 
     def to_dict(self, id=None):
-        return self.to_pydantic(id=id).dict()
+        # pydanticモデルを経由せずに組み立てる
+        if isinstance(self.data, BaseModel):
+            return self.to_pydantic(id=id).dict()
+
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": self.code, "message": self.message, "data": self.data},
+            "id": id,
+        }
+
+
+def encode(content: Any) -> bytes:
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
 
 
 class NoInit:
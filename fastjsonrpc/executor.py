@@ -0,0 +1,72 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+
+def call_model(model) -> Any:
+    return model()
+
+
+def _noop() -> int:
+    return os.getpid()
+
+
+class ProcessPool:
+    """Run CPU-bound methods in worker processes.
+
+    The executor is created on `start()` (or on the first call) and up to
+    `max_workers` processes are spawned. With `warmup`, every worker is started
+    up front so the first calls don't pay for spawning processes.
+    Models and results are sent between processes with pickle, so method classes
+    must be importable (defined at module level).
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        warmup: bool = True,
+        mp_context=None,
+    ):
+        if max_workers is not None and max_workers < 1:
+            raise ValueError("'max_workers' must be greater than 0.")
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.warmup = warmup
+        self.mp_context = mp_context
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def is_started(self) -> bool:
+        return self._executor is not None
+
+    async def start(self) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=self.mp_context
+            )
+            if self.warmup:
+                await self.run_warmup()
+
+    async def run_warmup(self) -> int:
+        """Start every worker and return the number of running processes."""
+        pids = await asyncio.gather(*(self.run(_noop) for _ in range(self.max_workers)))
+        return len(set(pids))
+
+    async def run(self, func: Callable, *args) -> Any:
+        if self._executor is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def shutdown(self, wait: bool = True) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    async def aclose(self) -> None:
+        """Stop the workers without blocking the event loop."""
+        # 実行中の呼び出しの完了とプロセスの終了を待つため、スレッドで停止する
+        await run_in_threadpool(self.shutdown)
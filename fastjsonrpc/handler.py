@@ -1,23 +1,50 @@
 import asyncio
+import inspect
 import json
-from typing import Any, Dict, Optional, Type, Union
+import logging
+from copy import deepcopy
+from time import perf_counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from fastapi import params
 from fastapi.datastructures import Default, DefaultPlaceholder
 from fastapi.dependencies.models import Dependant
-from fastapi.dependencies.utils import solve_dependencies
+from fastapi.dependencies.utils import get_missing_field_error, solve_dependencies
 from fastapi.encoders import DictIntStrAny, SetIntStr
 from fastapi.exceptions import RequestValidationError
 from fastapi.routing import run_endpoint_function, serialize_response
-from pydantic import ValidationError, parse_obj_as
+from pydantic import BaseModel, ValidationError
 from pydantic.error_wrappers import ErrorWrapper
 from pydantic.fields import ModelField
+from starlette.concurrency import iterate_in_threadpool
 from starlette.exceptions import HTTPException
-from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
 from . import exceptions
-from .schemas import RpcRequest, RpcRequestBatch, RpcRequestNotification, RpcResponse
+from .cache import CachedResult
+from .codec import JsonCodec
+from .instrumentation import DEPENDENCIES, HANDLER, SERIALIZE, VALIDATE, Instrumentation
+from .schemas import (
+    RpcRequest,
+    RpcRequestBase,
+    RpcRequestBatch,
+    RpcRequestNotification,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def get_request_handler(
@@ -33,11 +60,17 @@ def get_request_handler(
     response_model_exclude_defaults: bool = False,
     response_model_exclude_none: bool = False,
     dependency_overrides_provider: Optional[Any] = None,
+    codec: Optional[JsonCodec] = None,
+    method: Optional[str] = None,
+    instrumentation: Optional[Instrumentation] = None,
 ):
     # ) -> Callable[[Request], Coroutine[Any, Any, Response]]:
     assert dependant.call is not None, "dependant.call must be a function"
     is_coroutine = asyncio.iscoroutinefunction(dependant.call)
     is_body_form = body_field and isinstance(body_field.field_info, params.Form)
+    codec = codec or JsonCodec()
+    # 依存性がなければ、solve_dependenciesを経由せずパラメータモデルのみ検証する
+    params_field = dependant.body_params[0] if is_dependency_free(dependant) else None
     if isinstance(response_class, DefaultPlaceholder):
         actual_response_class: Type[Response] = response_class.value
     else:
@@ -67,7 +100,9 @@ def get_request_handler(
         #             else:
         #                 body = body_bytes
         # return body
-        return await request.json()
+        if not hasattr(request, "_json"):
+            request._json = codec.loads(await request.body())
+        return request._json
 
     async def parse_body(request: Request):
         try:
@@ -81,20 +116,59 @@ def get_request_handler(
 
         return body
 
+    def validate_params(body: Any):
+        values: Dict[str, Any] = {}
+        errors: List[ErrorWrapper] = []
+        loc = ("body",)
+
+        if body is None:
+            if params_field.required:
+                errors.append(get_missing_field_error(loc))
+            else:
+                values[params_field.name] = deepcopy(params_field.default)
+            return values, errors
+
+        value, errors_ = params_field.validate(body, values, loc=loc)
+        if isinstance(errors_, ErrorWrapper):
+            errors.append(errors_)
+        elif isinstance(errors_, list):
+            errors.extend(errors_)
+        else:
+            values[params_field.name] = value
+        return values, errors
+
+    def record_timing(stage: str, started: float):
+        if instrumentation is not None:
+            instrumentation.timing(method, stage, perf_counter() - started)
+
     async def run_endpoint(request: Request, body: Union[bytes, Any]):
-        solved_result = await solve_dependencies(
-            request=request,
-            dependant=dependant,
-            body=body,
-            dependency_overrides_provider=dependency_overrides_provider,
-        )
-        values, errors, background_tasks, sub_response, _ = solved_result
+        started = perf_counter()
+        if params_field is not None:
+            values, errors = validate_params(body)
+            background_tasks = None
+            sub_response = Response(content=None, status_code=None)
+            del sub_response.headers["content-length"]
+            record_timing(VALIDATE, started)
+        else:
+            solved_result = await solve_dependencies(
+                request=request,
+                dependant=dependant,
+                body=body,
+                dependency_overrides_provider=dependency_overrides_provider,
+            )
+            values, errors, background_tasks, sub_response, _ = solved_result
+            record_timing(DEPENDENCIES, started)
+
         if errors:
             raise RequestValidationError(errors, body=body)
 
-        raw_response = await run_endpoint_function(
-            dependant=dependant, values=values, is_coroutine=is_coroutine
-        )
+        started = perf_counter()
+        try:
+            raw_response = await run_endpoint_function(
+                dependant=dependant, values=values, is_coroutine=is_coroutine
+            )
+        finally:
+            record_timing(HANDLER, started)
         return raw_response, background_tasks, sub_response
 
     async def jsonalize(raw_response):
@@ -111,13 +185,17 @@ def get_request_handler(
         )
         return response_data
 
-    def create_http_response(response_data, background_tasks, sub_response):
+    def create_http_response(
+        response_data, background_tasks, sub_response, response_class=None
+    ):
         response_args: Dict[str, Any] = {"background": background_tasks}
         # If status_code was set, use it, otherwise use the default from the
         # response class, in the case of redirect it's 307
         if status_code is not None:
             response_args["status_code"] = status_code
-        response = actual_response_class(response_data, **response_args)
+        response = (response_class or actual_response_class)(
+            response_data, **response_args
+        )
         response.headers.raw.extend(sub_response.headers.raw)
         if sub_response.status_code:
             response.status_code = sub_response.status_code
@@ -139,9 +217,27 @@ def get_request_handler(
     )
 
 
-def parse_request(body, typ):
+def is_dependency_free(dependant: Dependant) -> bool:
+    """Whether the endpoint only takes the params model."""
+    return (
+        len(dependant.body_params) == 1
+        and not dependant.path_params
+        and not dependant.query_params
+        and not dependant.header_params
+        and not dependant.cookie_params
+        and not dependant.dependencies
+        and dependant.request_param_name is None
+        and dependant.websocket_param_name is None
+        and dependant.http_connection_param_name is None
+        and dependant.response_param_name is None
+        and dependant.background_tasks_param_name is None
+        and dependant.security_scopes_param_name is None
+    )
+
+
+def parse_request(body, typ: Type[BaseModel]):
     try:
-        validated = parse_obj_as(typ, body)
+        validated = typ.parse_obj(body)
         return validated, None
     except BaseException as e:
         return None, e
@@ -198,6 +294,10 @@ class JsonRpcRequest(CopyRequest):
     def is_batch(self):
         return isinstance(self._json_request, RpcRequestBatch)
 
+    @property
+    def is_notification(self):
+        return isinstance(self._json_request, RpcRequestNotification)
+
     def __iter__(self):
         if self.is_batch:
             yield from self._json_request.__root__
@@ -224,27 +324,45 @@ class JsonRpcRequest(CopyRequest):
     def _json_request(self):
         return self.scope["_jsonrpc_cache"]["request"]
 
-    async def validate(self, methods={}):
+    async def validate(self, methods={}, codec: Optional[JsonCodec] = None):
         if hasattr(self.scope, "_jsonrpc_cache"):
             return
 
+        codec = codec or JsonCodec()
+
         try:
-            await self.body()
+            if hasattr(self, "_body"):
+                buffer = self._body
+            else:
+                # 生のボディはパース後に不要なため、Requestには保持しない
+                self._stream_consumed = True
+                buffer = await read_body(self._receive, self.headers)
         except Exception as e:
             raise exceptions.InternalServerError() from e
 
         try:
-            body = await self.json()
+            body = codec.loads(buffer)
         except Exception as e:
             raise exceptions.ParseError(str(e)) from e
 
-        if not isinstance(body, (dict, list)):
-            raise exceptions.InvalidRequestError()
+        del buffer
+        self.validate_body(body, methods)
 
-        from .schemas import RpcRequest, RpcRequestBatch, RpcRequestNotification
+    def validate_body(self, body, methods={}):
+        validated = self.parse_envelope(body)
+        self.scope["_jsonrpc_cache"] = {"request": validated, "_body": b""}
 
-        if isinstance(body, list):
-            validated, err = parse_request(body, RpcRequestBatch)
+        if isinstance(validated, RpcRequestBatch):
+            if not validated.__root__:
+                raise exceptions.InvalidRequestError("batch must not be empty.")
+        else:
+            self.scope["_jsonrpc_cache"] = self.create_cache(validated, methods)
+
+    @staticmethod
+    def parse_envelope(body, allow_batch=True):
+        if isinstance(body, list) and allow_batch:
+            # メンバーは実行時に個別に検証し、不正なメンバーにだけエラーを返す
+            validated, err = RpcRequestBatch.construct(__root__=body), None
         elif isinstance(body, dict):
             if "id" in body:
                 validated, err = parse_request(body, RpcRequest)
@@ -257,34 +375,47 @@ class JsonRpcRequest(CopyRequest):
             err = to_rpc_error(err)
             raise err
 
-        if not isinstance(validated, RpcRequestBatch):
-            if not validated.method in methods:
-                raise exceptions.MethodNotFoundError()
+        return validated
+
+    def validate_session(self, body: Any, session: "RpcSession") -> Optional[Any]:
+        """Validate a request with the connection's cache and return its route.
+
+        Returns None if the request needs the full validation.
+        """
+        resolved = session.resolve(body)
+        if resolved is None:
+            return None
+
+        validated, route = resolved
+        self.scope["_jsonrpc_cache"] = {
+            "request": validated,
+            "_body": b"",
+            "_json": validated.params,
+        }
+        return route
 
+    @property
+    def is_validated(self):
+        return "_jsonrpc_cache" in self.scope
+
+    @staticmethod
+    def create_cache(validated, methods={}):
         _jsonrpc_cache = {
             "request": validated,
             "_body": b"",
         }
 
-        if isinstance(validated, RpcRequestBatch):
-            ...
+        if not validated.method in methods:
+            raise exceptions.MethodNotFoundError()
 
+        if isinstance(validated.params, dict):
+            _jsonrpc_cache["_json"] = validated.params
         else:
-            if not validated.method in methods:
-                raise exceptions.MethodNotFoundError()
-
-            if isinstance(validated.params, dict):
-                _jsonrpc_cache["_json"] = validated.params
-            elif isinstance(validated.params, list):
-                raise exceptions.InvalidRequestError(
-                    f"params must be dict. But given {type(validated.params)}."
-                )
-            else:
-                raise exceptions.InvalidRequestError(
-                    f"params must be dict. But given {type(validated.params)}."
-                )
+            raise exceptions.InvalidRequestError(
+                f"params must be dict. But given {type(validated.params)}."
+            )
 
-        self.scope["_jsonrpc_cache"] = _jsonrpc_cache
+        return _jsonrpc_cache
 
     def _restore_cache(self):
         cache = self.scope.get("_jsonrpc_cache", None)
@@ -294,6 +425,122 @@ class JsonRpcRequest(CopyRequest):
             # self._form = cache["_form"]
 
 
+PREALLOCATE_LIMIT = 1 << 16
+
+
+async def read_body(receive, headers=None) -> bytearray:
+    """Read an http request body into a single buffer.
+
+    The buffer is preallocated from content-length (up to `PREALLOCATE_LIMIT`) and
+    chunks are copied into it through a memoryview, so the body is not held twice
+    as a list of chunks and their concatenation. Content-length is not trusted:
+    beyond `PREALLOCATE_LIMIT`, the buffer grows at most to twice the bytes received.
+    """
+    try:
+        size = int(headers.get("content-length", "")) if headers else 0
+    except ValueError:
+        size = 0
+
+    buffer = bytearray(min(max(size, 0), PREALLOCATE_LIMIT))
+    view = memoryview(buffer)
+    length = 0
+
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnect()
+
+        chunk = message.get("body", b"")
+        end = length + len(chunk)
+        if end <= len(buffer):
+            view[length:end] = chunk
+        else:
+            view.release()
+            del buffer[length:]
+            buffer += chunk
+            # 申告されたサイズまで、受信済みの量に応じて確保する
+            if size > end:
+                buffer.extend(bytes(min(size, end * 2) - end))
+            view = memoryview(buffer)
+        length = end
+
+        if not message.get("more_body", False):
+            break
+
+    view.release()
+    del buffer[length:]
+    return buffer
+
+
+ENVELOPE_KEYS = frozenset(("jsonrpc", "method", "params", "id"))
+
+
+class RpcSession:
+    """Per-connection cache of resolved methods and envelope shapes.
+
+    Single requests to known methods with dict params and int ids are checked with
+    plain lookups instead of pydantic. Anything else returns None and goes through
+    the full validation. `handlers` are keyed by route path, and methods are looked
+    up under the `prefix` of the entrypoint.
+    """
+
+    MAX_METHODS = 256
+
+    def __init__(self, handlers: Dict[str, Any], prefix: str = "/"):
+        self.handlers = handlers
+        self.prefix = prefix
+        self.routes: Dict[str, Any] = {}
+        self.shapes: Set[Tuple[str, ...]] = set()
+
+    def resolve(self, body: Any) -> Optional[Tuple[RpcRequestBase, Any]]:
+        if type(body) is not dict:
+            return None
+
+        # キーの並びが同じエンベロープは、キーの検査を省く
+        shape = tuple(body)
+        if shape not in self.shapes:
+            if "method" not in body or not ENVELOPE_KEYS.issuperset(shape):
+                return None
+            self.shapes.add(shape)
+
+        if body.get("jsonrpc", "2.0") != "2.0":
+            return None
+
+        method = body["method"]
+        if type(method) is not str:
+            return None
+
+        route = self.routes.get(method, None)
+        if route is None:
+            route = self.handlers.get(self.prefix + method, None)
+            if route is None or len(self.routes) >= self.MAX_METHODS:
+                return None
+            self.routes[method] = route
+
+        params = body.get("params", {})
+        if type(params) is not dict:
+            return None
+
+        if "id" not in body:
+            validated = RpcRequestNotification.construct(
+                jsonrpc="2.0", method=method, params=params
+            )
+            return validated, route
+
+        id = body["id"]
+        if type(id) is not int:
+            return None
+
+        validated = RpcRequest.construct(
+            jsonrpc="2.0", method=method, params=params, id=id
+        )
+        return validated, route
+
+
+async def empty_receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
 class LocalResponse:
     def __init__(
         self,
@@ -327,9 +574,18 @@ class LocalResponse:
 
 
 class JsonRpcFutre(asyncio.Future):
-    def __init__(self, rpc=None, *, loop=None):
+    def __init__(
+        self,
+        rpc=None,
+        codec: Optional[JsonCodec] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        *,
+        loop=None,
+    ):
         super().__init__(loop=loop)
         self.rpc = rpc
+        self.codec = codec or JsonCodec()
+        self.instrumentation = instrumentation
 
     async def __call__(
         self, value, background, sub_response, jsonalize, create_http_response
@@ -340,7 +596,15 @@ class JsonRpcFutre(asyncio.Future):
             (value, background, sub_response, jsonalize, create_http_response)
         )
 
-    async def send_rpc_response(self, scope, receive, send):
+    async def get_rpc_response(
+        self, on_partial: Optional[Callable[[bytes], Awaitable]] = None
+    ):
+        """Encode the response.
+
+        For generator results, each item is passed to `on_partial` as a partial
+        frame and the returned body terminates the stream. Without `on_partial`,
+        items are collected into the result array.
+        """
         (
             raw_response,
             background,
@@ -348,7 +612,100 @@ class JsonRpcFutre(asyncio.Future):
             jsonalize,
             create_http_response,
         ) = await self
-        rpc_response = RpcResponse(result=raw_response, id=self.rpc.id)
-        jsonalized = await jsonalize(rpc_response)
-        response = create_http_response(jsonalized, background, sub_response)
+        # 結果のみをメソッドのresponse_modelで検証し、エンベロープは直接バイト列に書き出す
+        started = perf_counter()
+        if isinstance(raw_response, CachedResult):
+            # キャッシュ済みの結果は、idのみを埋め込む
+            encoded = await raw_response.encode(jsonalize, self.codec)
+            body = self.codec.render_response(encoded, self.rpc.id)
+        elif is_stream_result(raw_response):
+            body = await self.render_stream(raw_response, jsonalize, on_partial)
+        else:
+            jsonalized = await jsonalize(raw_response)
+            body = self.codec.render_response(self.codec.dumps(jsonalized), self.rpc.id)
+        if self.instrumentation is not None:
+            self.instrumentation.timing(
+                self.rpc.method, SERIALIZE, perf_counter() - started
+            )
+        return body, background, sub_response, create_http_response
+
+    async def render_stream(self, raw_response, jsonalize, on_partial=None) -> bytes:
+        # response_modelは各要素の型として扱う
+        if on_partial is None:
+            items = [await jsonalize(x) async for x in iterate_result(raw_response)]
+            return self.codec.render_response(self.codec.dumps(items), self.rpc.id)
+
+        async for item in iterate_result(raw_response):
+            encoded = self.codec.dumps(await jsonalize(item))
+            await on_partial(self.codec.render_partial(encoded, self.rpc.id))
+        return self.codec.render_response(self.codec.dumps(None), self.rpc.id)
+
+    async def send_rpc_response(self, scope, receive, send):
+        # 生成結果もresult配列に集めて1つの応答で返す
+        # 途中で失敗した場合に、resultとerrorの両方を含む応答を返さないため
+        (
+            body,
+            background,
+            sub_response,
+            create_http_response,
+        ) = await self.get_rpc_response()
+        response = create_http_response(body, background, sub_response, RawJSONResponse)
         await response(scope, receive, send)
+
+
+class RawJSONResponse(Response):
+    """Send already encoded json bytes as is."""
+
+    media_type = "application/json"
+
+
+class RawJSONStreamingResponse(StreamingResponse):
+    """Send already encoded json chunks as is."""
+
+    media_type = "application/json"
+
+
+async def stream_json_array(
+    iterator: AsyncIterator, jsonalize, codec: JsonCodec
+) -> AsyncIterator[bytes]:
+    """Encode the first item and return the chunks of a json array of all items.
+
+    Errors before the first item are raised. A json array has no place for a
+    later error, so the array is closed and the error is raised again, which
+    makes the server abort the response instead of completing it.
+    """
+    try:
+        first: Optional[bytes] = codec.dumps(
+            await jsonalize(await iterator.__anext__())
+        )
+    except StopAsyncIteration:
+        first = None
+
+    async def chunks():
+        if first is None:
+            yield b"[]"
+            return
+
+        yield b"[" + first
+        try:
+            async for item in iterator:
+                yield b"," + codec.dumps(await jsonalize(item))
+        except Exception:
+            # 配列は閉じるが、応答を完了させずに接続を切断して失敗を伝える
+            yield b"]"
+            raise
+        yield b"]"
+
+    return chunks()
+
+
+def is_stream_result(result) -> bool:
+    """Whether the method returned items to stream."""
+    return inspect.isgenerator(result) or inspect.isasyncgen(result)
+
+
+def iterate_result(result) -> AsyncIterator:
+    if inspect.isasyncgen(result):
+        return result
+    # 同期ジェネレータはイベントループを止めないようスレッドで進める
+    return iterate_in_threadpool(result)
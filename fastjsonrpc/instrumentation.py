@@ -0,0 +1,160 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+""" Stages of a json rpc call
+parse       : decode the request body and validate the json rpc envelope
+validate    : validate params (only for methods without dependencies)
+dependencies: solve dependencies including params validation
+handler     : run the method
+serialize   : validate the result with response_model and encode the response
+"""
+PARSE = "parse"
+VALIDATE = "validate"
+DEPENDENCIES = "dependencies"
+HANDLER = "handler"
+SERIALIZE = "serialize"
+
+STAGES = (PARSE, VALIDATE, DEPENDENCIES, HANDLER, SERIALIZE)
+
+
+class Instrumentation:
+    """Receive per-method timings and errors from JsonRpcRouter.
+
+    `method` is None when the request can't be attributed to a method
+    (e.g. parse errors or parsing a whole batch).
+    """
+
+    def timing(self, method: Optional[str], stage: str, seconds: float) -> None:
+        ...
+
+    def error(self, method: Optional[str], code: int) -> None:
+        ...
+
+
+class CallbackInstrumentation(Instrumentation):
+    """Forward timings and errors to callbacks."""
+
+    def __init__(
+        self,
+        on_timing: Optional[Callable[[Optional[str], str, float], None]] = None,
+        on_error: Optional[Callable[[Optional[str], int], None]] = None,
+    ):
+        self.on_timing = on_timing
+        self.on_error = on_error
+
+    def timing(self, method: Optional[str], stage: str, seconds: float) -> None:
+        if self.on_timing is not None:
+            self.on_timing(method, stage, seconds)
+
+    def error(self, method: Optional[str], code: int) -> None:
+        if self.on_error is not None:
+            self.on_error(method, code)
+
+
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket containing the quantile."""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+        }
+
+
+class HistogramInstrumentation(Instrumentation):
+    """Keep latency histograms and error counts in memory."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self) -> None:
+        self.histograms: Dict[Tuple[Optional[str], str], Histogram] = {}
+        self.errors: Dict[Tuple[Optional[str], int], int] = {}
+        self.started = time.monotonic()
+
+    def timing(self, method: Optional[str], stage: str, seconds: float) -> None:
+        key = (method, stage)
+        histogram = self.histograms.get(key, None)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def error(self, method: Optional[str], code: int) -> None:
+        key = (method, code)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[Optional[str], dict]:
+        """Return stats per method.
+
+        {method: {"calls": int, "calls_per_sec": float, "stages": {stage: {...}},
+        "errors": {code: count}}}
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        methods: Dict[Optional[str], dict] = {}
+
+        def get(method):
+            if method not in methods:
+                methods[method] = {"calls": 0, "stages": {}, "errors": {}}
+            return methods[method]
+
+        for (method, stage), histogram in self.histograms.items():
+            stats = get(method)
+            stats["stages"][stage] = histogram.to_dict()
+            if stage == HANDLER:
+                stats["calls"] = histogram.count
+
+        for (method, code), count in self.errors.items():
+            get(method)["errors"][code] = count
+
+        for stats in methods.values():
+            stats["calls_per_sec"] = stats["calls"] / elapsed
+
+        return methods
@@ -102,11 +102,15 @@ class StateLocalClient:
         async def execute():
             result = []
 
+            body = request.body or b""
+            if isinstance(body, str):
+                body = body.encode("utf8")
+
             async def recieve():
                 return {
                     "type": "http.request",
                     "more_body": False,
-                    "body": request.body.encode("utf8") if request.body else b"",
+                    "body": body,
                 }
 
             async def send(msg):
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+from .errorlog import ErrorLog
+from .exceptions import RpcBaseError
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationPool:
+    """Run notification handlers in the background.
+
+    At most `concurrency` handlers run at once. Further handlers wait in a queue of
+    `max_queue_size` and are dropped when the queue is full. Unexpected errors of
+    handlers are logged through `error_log`; drops are logged once per burst with
+    the number of dropped notifications.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 10,
+        max_queue_size: int = 1000,
+        error_log: Optional[ErrorLog] = None,
+    ):
+        if concurrency < 1:
+            raise ValueError("'concurrency' must be greater than 0.")
+
+        if max_queue_size < 0:
+            raise ValueError("'max_queue_size' must be 0 or greater.")
+
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self.error_log = error_log
+        self._queue: Deque[Callable[[], Awaitable]] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._unreported_drops = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def submit(self, func: Callable[[], Awaitable]) -> bool:
+        """Schedule `func()` and return immediately. Returns False if dropped."""
+        if self.running < self.concurrency:
+            self._report_drops()
+            self.running += 1
+            task = asyncio.create_task(self._run(func))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return True
+
+        if len(self._queue) >= self.max_queue_size:
+            self.dropped += 1
+            if not self._unreported_drops:
+                logger.warning("Notification queue is full. Dropping notifications.")
+            self._unreported_drops += 1
+            return False
+
+        self._report_drops()
+        self._queue.append(func)
+        return True
+
+    def _report_drops(self) -> None:
+        # キューが空くまでの破棄数をまとめて1件だけ記録する
+        if self._unreported_drops:
+            logger.warning(
+                "%s notifications were dropped while the queue was full.",
+                self._unreported_drops,
+            )
+            self._unreported_drops = 0
+
+    async def _run(self, func: Callable[[], Awaitable]) -> None:
+        # 実行枠を保持したまま、キューに溜まった通知を順に処理する
+        try:
+            while True:
+                try:
+                    await func()
+                    self.completed += 1
+                except Exception as e:
+                    self.failed += 1
+                    # RpcBaseErrorは想定されたエラーで、ハンドラ側で記録済み
+                    if self.error_log is not None and not isinstance(e, RpcBaseError):
+                        self.error_log.log(e)
+
+                if not self._queue:
+                    break
+                func = self._queue.popleft()
+        finally:
+            self.running -= 1
+
+    async def join(self) -> None:
+        """Wait until all scheduled notifications are done."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -2,26 +2,55 @@ import asyncio
 import json
 import logging
 from asyncio.log import logger
+from contextlib import AsyncExitStack
 from sys import prefix
-from typing import TYPE_CHECKING, Any, Callable, Coroutine, Optional, Union
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from urllib import response
 
-from fastapi import APIRouter, HTTPException, Request, Response, background
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from pydantic import BaseModel, parse_obj_as
 from pydantic.error_wrappers import ErrorWrapper
+from starlette.requests import ClientDisconnect
 from starlette.websockets import WebSocket
 
 from . import exceptions
+from .cache import CachedResult, ResultCache, params_key
+from .client import LocalRpcClient
+from .codec import JsonCodec, get_codec
+from .compression import CompressingSend, HttpCompression, WebSocketCompression
+from .errorlog import ErrorLog
+from .executor import ProcessPool, call_model
 from .handler import (
     DispatchRequest,
     JsonRpcFutre,
     JsonRpcRequest,
     LocalResponse,
+    RawJSONResponse,
+    RawJSONStreamingResponse,
+    RpcSession,
+    empty_receive,
     get_request_handler,
+    is_stream_result,
+    iterate_result,
+    stream_json_array,
 )
+from .instrumentation import PARSE, Instrumentation
+from .notification import NotificationPool
 from .schemas import (
     RpcEntryPoint,
     RpcRequest,
@@ -30,10 +59,10 @@ from .schemas import (
     RpcResponse,
     RpcResponseError,
 )
+from .stream import BatchStreamParser
 from .websocket import JsonRpcWebSocket
 
 logger = logging.getLogger(__name__)
-logger.setLevel("DEBUG")
 
 
 # https://fastapi.tiangolo.com/advanced/custom-request-and-route/
@@ -87,18 +116,73 @@ class LazyJSONResponse(JSONResponse):
         )
         self.content = content
 
+    codec: JsonCodec = JsonCodec()
+
+    @classmethod
+    def _create_response_class(cls, codec: JsonCodec):
+        class LazyJSONResponse(cls):
+            ...
+
+        LazyJSONResponse.__name__ = cls.__name__
+        LazyJSONResponse.codec = codec
+        return LazyJSONResponse
+
+    def render(self, content: Any) -> bytes:
+        return self.codec.dumps(content)
+
 
 class JsonRpcRoute(APIRoute):
     _methods = {}
+    _handlers: Dict[str, "JsonRpcRoute"] = {}
+    _batch_concurrency: Optional[int] = None
+    _codec: JsonCodec = JsonCodec()
+    _notifications: NotificationPool = NotificationPool()
+    _instrumentation: Optional[Instrumentation] = None
+    _stream_batches: bool = False
+    _error_log: ErrorLog = ErrorLog()
+    _websocket_compression: Optional[WebSocketCompression] = None
+    _http_compression: Optional[HttpCompression] = None
+    _uncompressed: Set[str] = set()
+    STREAM_BATCH_CONCURRENCY: int = 100
 
     @classmethod
-    def _create_router(cls):
+    def _create_router(
+        cls,
+        batch_concurrency=None,
+        codec=None,
+        notifications=None,
+        instrumentation=None,
+        stream_batches=False,
+        error_log=None,
+        websocket_compression=None,
+        http_compression=None,
+    ):
         class JsonRpcRoute(cls):
             _methods = {}
+            _handlers = {}
+            _uncompressed = set()
 
         JsonRpcRoute.__name__ = cls.__name__
+        JsonRpcRoute._batch_concurrency = batch_concurrency
+        JsonRpcRoute._codec = codec or cls._codec
+        JsonRpcRoute._notifications = notifications or NotificationPool()
+        JsonRpcRoute._instrumentation = instrumentation
+        JsonRpcRoute._stream_batches = stream_batches
+        JsonRpcRoute._error_log = error_log or ErrorLog()
+        if JsonRpcRoute._notifications.error_log is None:
+            JsonRpcRoute._notifications.error_log = JsonRpcRoute._error_log
+        JsonRpcRoute._websocket_compression = websocket_compression
+        JsonRpcRoute._http_compression = http_compression
         return JsonRpcRoute
 
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, endpoint, **kwargs)
+        # 同じルーターを複数のprefixでincludeしても依存性が混ざらないよう、パスで引く
+        # include_routerで複製されたルートが後から登録され、同じパスのものを上書きする
+        name = getattr(endpoint, "_jsonrpc_method", None)
+        if name is not None:
+            self._handlers[self.path] = self
+
     async def handle(self, scope, receive, send) -> None:
         if self.methods and scope["method"] not in self.methods:
             if "app" in scope:
@@ -113,53 +197,514 @@ class JsonRpcRoute(APIRoute):
             await self.app(scope, receive, send)
             return
 
-        dispacher = DispatchRequest(scope, receive, send)
-
         # if direct rpc request
         if not hasattr(self.endpoint, "_is_jsonrpc_entrypoint"):
-            await self.app(scope, receive, send)
+            method = getattr(self.endpoint, "_jsonrpc_method", None)
+            await self.app(scope, receive, self.compress_send(scope, send, method))
             return
 
+        send = self.compress_send(scope, send)
+
+        if self._stream_batches:
+            receive, is_batch = await self.peek_batch(receive)
+            if is_batch:
+                await self.handle_batch_stream(scope, receive, send)
+                return
+
         rpc = None
         err = None
 
         try:
             rpc = JsonRpcRequest(scope, receive, send)
-            await rpc.validate(self._methods)
+            started = perf_counter()
+            await rpc.validate(self._methods, self._codec)
+            self.record_timing(self.get_method_name(rpc), PARSE, started)
 
             if rpc.is_batch:
-                raise NotImplementedError()
+                await self.handle_batch(scope, receive, send, rpc)
+                return
 
-            # pathを書き換えて再度ルーティングをし直す
-            dispacher.rerouting(
-                entrypath=scope["path"], path=scope["path"] + rpc.method
-            )
-            future = JsonRpcFutre(rpc)
-            await scope["router"].__call__(scope, receive, future)
+            if rpc.method in self._uncompressed and isinstance(send, CompressingSend):
+                send.enabled = False
+
+            if rpc.is_notification:
+                self.notify(scope, receive)
+                await Response(status_code=204)(scope, receive, send)
+                return
+
+            future = await self.call_method(scope, receive, rpc)
             await future.send_rpc_response(scope, receive, send)
             return
 
-        except RequestValidationError as e:
-            err = exceptions.InvalidParamsError(e.errors())
+        except Exception as e:
+            err = self.to_rpc_error(e)
+
+        if err:
+            method = self.get_method_name(rpc)
 
-        except exceptions.RpcBaseError as e:
-            err = e
+            # 通知には応答しない
+            if rpc is not None and rpc.is_validated and rpc.is_notification:
+                self.record_error(method, err)
+                await Response(status_code=204)(scope, receive, send)
+                return
 
-        except Exception as e:
-            import sys
-            import traceback
+            id = rpc.id if rpc is not None and rpc.is_validated else None
+            response = RawJSONResponse(
+                self.render_error(err, id, method), status_code=200
+            )
+            await response(scope, receive, send)
+            return
 
-            # starletteなど関数を実行した場所からの例外と認識してしまうため
-            # 本当の例外発生元を取得
-            original_tb = e.__traceback__.tb_next.tb_next.tb_next.tb_next
-            logger.critical(f"{type(e)} {str(e)}: {str(original_tb.tb_frame)}")
-            err = exceptions.InternalServerError(str(e))
+    async def handle_batch(self, scope, receive, send, rpc: JsonRpcRequest) -> None:
+        """Run every member of a batch concurrently and send one array response."""
+        body, background_tasks, headers = await self.call_batch(scope, receive, rpc)
+        if body is None:
+            response = Response(status_code=204, background=background_tasks)
+        else:
+            response = RawJSONResponse(
+                body, status_code=200, background=background_tasks
+            )
+        response.headers.raw.extend(headers)
+        await response(scope, receive, send)
+
+    @staticmethod
+    async def peek_batch(receive) -> Tuple[Callable, bool]:
+        """Read the body until the first json token and tell whether it is a batch.
+
+        Returns `receive` replaying the messages read so far.
+        """
+        messages = []
+        head = b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            head = message.get("body", b"").lstrip()
+            if head or not message.get("more_body", False):
+                break
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        return replay, head[:1] == b"["
+
+    async def handle_batch_stream(self, scope, receive, send) -> None:
+        """Run a batch while it is being received and stream the response array.
+
+        Members are dispatched as soon as they are parsed (up to `batch_concurrency`,
+        default `STREAM_BATCH_CONCURRENCY`, at once) and their responses are sent as
+        they complete. Headers set by members are not sent.
+        """
+        parser = BatchStreamParser()
+        semaphore = asyncio.Semaphore(
+            self._batch_concurrency or self.STREAM_BATCH_CONCURRENCY
+        )
+        send_lock = asyncio.Lock()
+        background_tasks = BackgroundTasks()
+        tasks = set()
+        started = False
+
+        async def write(content: bytes):
+            nonlocal started
+            async with send_lock:
+                if not started:
+                    started = True
+                    await send(
+                        {
+                            "type": "http.response.start",
+                            "status": 200,
+                            "headers": [(b"content-type", b"application/json")],
+                        }
+                    )
+                    content = b"[" + content
+                else:
+                    content = b"," + content
+                await send(
+                    {"type": "http.response.body", "body": content, "more_body": True}
+                )
 
-        if err:
-            response = JSONResponse(err.to_dict(), status_code=200)
+        async def execute(member):
+            try:
+                content, background = await self.handle_stream_member(scope, member)
+                if background is not None:
+                    background_tasks.tasks.extend(
+                        getattr(background, "tasks", [background])
+                    )
+                if content is not None:
+                    await write(content)
+            finally:
+                semaphore.release()
+
+        def done(task: asyncio.Task):
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                failures.append(task.exception())
+
+        failures = []
+        err = None
+        try:
+            try:
+                more_body = True
+                while more_body and not failures:
+                    message = await receive()
+                    if message["type"] == "http.disconnect":
+                        raise ClientDisconnect()
+
+                    more_body = message.get("more_body", False)
+                    members = parser.feed(message.get("body", b""))
+                    if not more_body:
+                        members += parser.close()
+
+                    for member in members:
+                        # 実行中のメンバーが上限に達したら、受信を止める
+                        await semaphore.acquire()
+                        task = asyncio.create_task(execute(member))
+                        tasks.add(task)
+                        task.add_done_callback(done)
+
+            except exceptions.RpcBaseError as e:
+                err = e
+
+            await asyncio.gather(*tasks)
+            if failures:
+                raise failures[0]
+
+        except BaseException:
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        if err is None and not parser.count:
+            err = exceptions.InvalidRequestError("batch must not be empty.")
+
+        if err is not None:
+            if not started:
+                response = RawJSONResponse(self.render_error(err), status_code=200)
+                await response(scope, receive, send)
+                return
+            # 応答済みの要素があるため、エラーを配列の末尾に加える
+            await write(self.render_error(err))
+
+        if not started:
+            response = Response(status_code=204, background=background_tasks)
             await response(scope, receive, send)
             return
 
+        await send({"type": "http.response.body", "body": b"]", "more_body": False})
+        await background_tasks()
+
+    async def handle_stream_member(
+        self, scope, member: Any
+    ) -> Tuple[Optional[bytes], Optional[BackgroundTasks]]:
+        content, background, _ = await self.handle_member(scope, empty_receive, member)
+        return content, background
+
+    async def handle_member(self, scope, receive, member: Any):
+        """Validate a decoded member of a batch and run it.
+
+        An invalid member is answered with its own error, the others still run.
+        """
+        try:
+            request = JsonRpcRequest.parse_envelope(member, allow_batch=False)
+        except Exception as e:
+            err = self.to_rpc_error(e)
+            id = member.get("id", None) if isinstance(member, dict) else None
+            id = id if isinstance(id, int) else None
+            return self.render_error(err, id, codec=self.get_codec(scope)), None, None
+
+        return await self.handle_batch_member(scope, receive, request)
+
+    async def dispatch(
+        self,
+        scope,
+        receive,
+        data: Union[bytes, str],
+        on_partial: Optional[Callable[[bytes], Awaitable]] = None,
+        session: Optional[RpcSession] = None,
+    ) -> Tuple[Optional[bytes], Optional[BackgroundTasks]]:
+        """Run an encoded json rpc request without going through http.
+
+        Returns the encoded response (None for notifications) and the background
+        tasks to run after it is sent. Items of streamed results are passed to
+        `on_partial` before the response is returned. With `session`, requests are
+        validated with the connection's cache when possible.
+        """
+        started = perf_counter()
+        codec = self.get_codec(scope)
+        try:
+            body = codec.loads(data)
+        except Exception as e:
+            return self.render_error(exceptions.ParseError(str(e)), codec=codec), None
+
+        return await self.dispatch_body(
+            scope, receive, body, on_partial, session, started
+        )
+
+    async def dispatch_body(
+        self,
+        scope,
+        receive,
+        body: Any,
+        on_partial: Optional[Callable[[bytes], Awaitable]] = None,
+        session: Optional[RpcSession] = None,
+        started: Optional[float] = None,
+    ) -> Tuple[Optional[bytes], Optional[BackgroundTasks]]:
+        """Run a decoded json rpc request without going through http."""
+        rpc = None
+        route = None
+        started = started or perf_counter()
+
+        try:
+            rpc = JsonRpcRequest(scope, receive, None)
+            if session is not None:
+                route = rpc.validate_session(body, session)
+            if route is None:
+                rpc.validate_body(body, self._methods)
+            self.record_timing(self.get_method_name(rpc), PARSE, started)
+
+            if rpc.is_batch:
+                content, background, _ = await self.call_batch(scope, receive, rpc)
+                return content, background
+
+            if rpc.is_notification:
+                self.notify(scope, receive)
+                return None, None
+
+            future = await self.call_method(scope, receive, rpc, route)
+            content, background, _, _ = await future.get_rpc_response(on_partial)
+            return content, background
+
+        except Exception as e:
+            err = self.to_rpc_error(e)
+
+        method = self.get_method_name(rpc)
+        if rpc is not None and rpc.is_validated and rpc.is_notification:
+            self.record_error(method, err)
+            return None, None
+
+        id = rpc.id if rpc is not None and rpc.is_validated else None
+        return self.render_error(err, id, method, self.get_codec(scope)), None
+
+    async def invoke(
+        self,
+        scope,
+        receive,
+        body: Any,
+        session: Optional[RpcSession] = None,
+    ) -> Tuple[Any, Optional[BackgroundTasks]]:
+        """Run a decoded request and return its result without encoding it.
+
+        Errors are raised as `RpcBaseError`. Notifications are submitted to the
+        notification pool and return None.
+        """
+        rpc = None
+        route = None
+
+        try:
+            rpc = JsonRpcRequest(scope, receive, None)
+            if session is not None:
+                route = rpc.validate_session(body, session)
+            if route is None:
+                rpc.validate_body(body, self._methods)
+
+            if rpc.is_batch:
+                raise exceptions.InvalidRequestError("batch is not allowed.")
+
+            if rpc.is_notification:
+                self.notify(scope, receive)
+                return None, None
+
+            future = await self.call_method(scope, receive, rpc, route)
+            raw_response, background, _, jsonalize, _ = await future
+            if isinstance(raw_response, CachedResult):
+                result = await jsonalize(raw_response.value)
+            elif is_stream_result(raw_response):
+                result = [
+                    await jsonalize(x) async for x in iterate_result(raw_response)
+                ]
+            else:
+                result = await jsonalize(raw_response)
+            return result, background
+
+        except Exception as e:
+            err = self.to_rpc_error(e)
+
+        self.record_error(self.get_method_name(rpc), err)
+        raise err
+
+    async def call_batch(self, scope, receive, rpc: JsonRpcRequest):
+        if self._batch_concurrency:
+            semaphore = asyncio.Semaphore(self._batch_concurrency)
+        else:
+            semaphore = None
+
+        async def execute(member):
+            if semaphore is None:
+                return await self.handle_member(scope, receive, member)
+
+            async with semaphore:
+                return await self.handle_member(scope, receive, member)
+
+        results = await asyncio.gather(*(execute(request) for request in rpc))
+
+        background_tasks = BackgroundTasks()
+        contents = []
+        headers = []
+        for content, background, sub_response in results:
+            if content is not None:
+                contents.append(content)
+            if background is not None:
+                background_tasks.tasks.extend(
+                    getattr(background, "tasks", [background])
+                )
+            if sub_response is not None:
+                headers.extend(sub_response.headers.raw)
+
+        # 通知のみのバッチには応答しない
+        if not contents:
+            return None, background_tasks, headers
+
+        body = self.get_codec(scope).render_batch(contents)
+        return body, background_tasks, headers
+
+    async def handle_batch_member(self, scope, receive, request):
+        # 各メンバーは独立したscopeでルーティングされる
+        member_scope = dict(scope)
+        member_scope.pop("_dispatcher", None)
+        rpc = None
+
+        try:
+            member_scope["_jsonrpc_cache"] = JsonRpcRequest.create_cache(
+                request, self._methods
+            )
+            rpc = JsonRpcRequest(member_scope, receive, None)
+            if rpc.is_notification:
+                self.notify(member_scope, receive)
+                return None, None, None
+
+            future = await self.call_method(member_scope, receive, rpc)
+            body, background, sub_response, _ = await future.get_rpc_response()
+            return body, background, sub_response
+
+        except Exception as e:
+            err = self.to_rpc_error(e)
+
+        if isinstance(request, RpcRequestNotification):
+            self.record_error(self.get_member_method_name(request), err)
+            return None, None, None
+
+        method = self.get_member_method_name(request)
+        codec = self.get_codec(scope)
+        return self.render_error(err, request.get_id(), method, codec), None, None
+
+    def get_handler(self, method: str) -> Optional["JsonRpcRoute"]:
+        """The route of `method` included with the same prefix as this entrypoint."""
+        return self._handlers.get(self.path + method, None)
+
+    async def call_method(
+        self, scope, receive, rpc: JsonRpcRequest, route=None
+    ) -> JsonRpcFutre:
+        """Call the method route directly without routing the request again."""
+        if route is None:
+            route = self.get_handler(rpc.method)
+        if route is None:
+            raise exceptions.MethodNotFoundError()
+
+        dispacher = DispatchRequest(scope, receive, None)
+        dispacher.rerouting(entrypath=scope["path"], path=scope["path"] + rpc.method)
+        scope["endpoint"] = route.endpoint
+
+        future = JsonRpcFutre(rpc, self.get_codec(scope), self._instrumentation)
+        await route.app(scope, receive, future)
+        return future
+
+    def notify(self, scope, receive) -> bool:
+        """Run a validated notification in the background and return immediately."""
+        return self._notifications.submit(
+            lambda: self.call_notification(dict(scope), receive)
+        )
+
+    async def call_notification(self, scope, receive) -> None:
+        rpc = JsonRpcRequest(scope, receive, None)
+        try:
+            # 応答後に実行されるため、依存性の後処理は通知ごとに行う
+            async with AsyncExitStack() as stack:
+                scope["fastapi_astack"] = stack
+                future = await self.call_method(scope, receive, rpc)
+                raw_response, background, *_ = await future
+                if is_stream_result(raw_response):
+                    async for _ in iterate_result(raw_response):
+                        ...
+
+            if background is not None:
+                await background()
+
+        except Exception as e:
+            # 内部エラーはto_rpc_errorで記録済みのため、RpcBaseErrorとしてプールに返す
+            err = self.to_rpc_error(e)
+            self.record_error(rpc.method, err)
+            if err is e:
+                raise
+            raise err from e
+
+    def render_error(
+        self,
+        err: exceptions.RpcBaseError,
+        id=None,
+        method: Optional[str] = None,
+        codec: Optional[JsonCodec] = None,
+    ) -> bytes:
+        self.record_error(method, err)
+        return (codec or self._codec).render_error(err, id)
+
+    def compress_send(self, scope, send, method: Optional[str] = None):
+        """Wrap `send` to compress the response if the client accepts it."""
+        compression = self._http_compression
+        if compression is None or method in self._uncompressed:
+            return send
+
+        encoding = compression.negotiate(scope)
+        if encoding is None:
+            return send
+        return CompressingSend(send, compression, encoding)
+
+    def get_codec(self, scope) -> JsonCodec:
+        """The codec negotiated by the connection, or the router's codec."""
+        return scope.get("_jsonrpc_codec", None) or self._codec
+
+    def get_method_name(self, rpc: Optional[JsonRpcRequest]) -> Optional[str]:
+        if rpc is None or not rpc.is_validated or rpc.is_batch:
+            return None
+        # 存在しないメソッド名で集計先が増え続けないようにする
+        return rpc.method if rpc.method in self._methods else None
+
+    def get_member_method_name(self, request) -> Optional[str]:
+        method = getattr(request, "method", None)
+        return method if method in self._methods else None
+
+    def record_timing(self, method: Optional[str], stage: str, started: float):
+        if self._instrumentation is not None:
+            self._instrumentation.timing(method, stage, perf_counter() - started)
+
+    def record_error(self, method: Optional[str], err: exceptions.RpcBaseError):
+        if self._instrumentation is not None:
+            self._instrumentation.error(method, err.code)
+
+    def to_rpc_error(self, e: Exception) -> exceptions.RpcBaseError:
+        if isinstance(e, RequestValidationError):
+            return exceptions.InvalidParamsError(e.errors())
+
+        elif isinstance(e, exceptions.RpcBaseError):
+            return e
+
+        else:
+            self._error_log.log(e)
+            return exceptions.InternalServerError(str(e))
+
     def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
         jsonalize, invork, create_http_response = get_request_handler(
             dependant=self.dependant,
@@ -174,6 +719,9 @@ class JsonRpcRoute(APIRoute):
             response_model_exclude_defaults=self.response_model_exclude_defaults,
             response_model_exclude_none=self.response_model_exclude_none,
             dependency_overrides_provider=self.dependency_overrides_provider,
+            codec=self._codec,
+            method=getattr(self.endpoint, "_jsonrpc_method", None),
+            instrumentation=self._instrumentation,
         )
         # return app
         async def custom_route_handler(request: Request) -> Response:
@@ -187,7 +735,21 @@ class JsonRpcRoute(APIRoute):
 
             raw_response, background_tasks, sub_response = await invork(request)
 
-            if dispacher.is_direct:
+            if dispacher.is_direct and isinstance(raw_response, CachedResult):
+                encoded = await raw_response.encode(jsonalize, self._codec)
+                response = create_http_response(
+                    encoded, background_tasks, sub_response, RawJSONResponse
+                )
+            elif dispacher.is_direct and is_stream_result(raw_response):
+                chunks = await stream_json_array(
+                    iterate_result(raw_response),
+                    jsonalize,
+                    self._codec,
+                )
+                response = create_http_response(
+                    chunks, background_tasks, sub_response, RawJSONStreamingResponse
+                )
+            elif dispacher.is_direct:
                 jsonalized = await jsonalize(raw_response)
                 response = create_http_response(
                     jsonalized, background_tasks, sub_response
@@ -215,7 +777,21 @@ class JsonRpcRouter(PostOnlyRouter):
     if not TYPE_CHECKING:
 
         def __init__(
-            self, prefix="", default_response_class=None, route_class=None, **kwargs
+            self,
+            prefix="",
+            default_response_class=None,
+            route_class=None,
+            batch_concurrency: Optional[int] = None,
+            codec: Optional[Union[str, JsonCodec]] = None,
+            notification_concurrency: int = 10,
+            notification_queue_size: int = 1000,
+            instrumentation: Optional[Instrumentation] = None,
+            stream_batches: bool = False,
+            process_workers: Optional[int] = None,
+            error_log: Optional[ErrorLog] = None,
+            websocket_compression: Optional[WebSocketCompression] = None,
+            http_compression: Optional[HttpCompression] = None,
+            **kwargs,
         ):
             # if kwargs.get("prefix", "") != "":
             #     raise ValueError("must be empty.")
@@ -230,11 +806,30 @@ class JsonRpcRouter(PostOnlyRouter):
             if route_class is not None:
                 raise ValueError("'route_class' is not allowed with jsonrpc router.")
 
-            route_cls = self.dispatcher_cls._create_router()
+            if batch_concurrency is not None and batch_concurrency < 1:
+                raise ValueError("'batch_concurrency' must be greater than 0.")
+
+            codec = get_codec(codec)
+            notifications = NotificationPool(
+                concurrency=notification_concurrency,
+                max_queue_size=notification_queue_size,
+            )
+            route_cls = self.dispatcher_cls._create_router(
+                batch_concurrency=batch_concurrency,
+                codec=codec,
+                notifications=notifications,
+                instrumentation=instrumentation,
+                stream_batches=stream_batches,
+                error_log=error_log,
+                websocket_compression=websocket_compression,
+                http_compression=http_compression,
+            )
             APIRouter.__init__(
                 self,
                 route_class=route_cls,
-                default_response_class=self.RESPONSE_CLASS,
+                default_response_class=self.RESPONSE_CLASS._create_response_class(
+                    codec
+                ),
                 **kwargs,
             )
 
@@ -245,6 +840,16 @@ class JsonRpcRouter(PostOnlyRouter):
                 response_model=self.EntryPoint.__call__.__annotations__["return"],
             )(self.EntryPoint)
             self._methods = route_cls._methods
+            self._handlers = route_cls._handlers
+            self._codec = codec
+            self.notifications = notifications
+            self.instrumentation = instrumentation
+            self.processes = ProcessPool(max_workers=process_workers)
+            self.caches: Dict[str, ResultCache] = {}
+            self.error_log = route_cls._error_log
+            self.websocket_compression = websocket_compression
+            self.http_compression = http_compression
+            self._uncompressed = route_cls._uncompressed
 
     def include_router(self, router: "JsonRpcRouter", **kwargs):  # type: ignore
         raise NotImplementedError()
@@ -257,12 +862,31 @@ class JsonRpcRouter(PostOnlyRouter):
 
             return self._post(path=path, **kwargs)
 
-    def _post(self, path=None, **kwargs):
+    def _post(
+        self,
+        path=None,
+        executor: Optional[str] = None,
+        cache: Union[bool, ResultCache, None] = None,
+        compress: bool = True,
+        **kwargs,
+    ):
         to_snake_case = get_snake_case_converter()
 
+        if executor not in (None, "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+
+        if cache is True:
+            cache = ResultCache()
+        elif cache is False:
+            cache = None
+
         def wrapper(func_or_basemodel):
             nonlocal path
-            func = try_get_as_func(func_or_basemodel)
+            if executor == "process":
+                func = try_get_as_process_func(func_or_basemodel, self.processes)
+                self._use_processes()
+            else:
+                func = try_get_as_func(func_or_basemodel)
             if func is None:
                 raise NotImplementedError()
                 func = func_or_basemodel
@@ -275,7 +899,15 @@ class JsonRpcRouter(PostOnlyRouter):
                 else:
                     name = path[1:]
 
+                if cache is not None:
+                    func = try_get_as_cached_func(func, name, cache)
+                    self.caches[name] = cache
+
+                if not compress:
+                    self._uncompressed.add(name)
+
                 self._methods[name] = func_or_basemodel
+                func._jsonrpc_method = name
 
             register = APIRouter.post(self, path=path, **kwargs)
             register(func)
@@ -283,7 +915,14 @@ class JsonRpcRouter(PostOnlyRouter):
 
         return wrapper
 
+    def _use_processes(self):
+        # アプリの起動時にワーカーを立ち上げ、終了時に停止する
+        if self.processes.aclose not in self.on_shutdown:
+            self.on_startup.append(self.processes.start)
+            self.on_shutdown.append(self.processes.aclose)
+
     get_websocket = JsonRpcWebSocket.get_websocket
+    get_client = LocalRpcClient.get_client
 
 
 def get_snake_case_converter():
@@ -327,3 +966,61 @@ def try_get_as_func(cls):
 
     else:
         return None
+
+
+def try_get_as_cached_func(func, name: str, cache: ResultCache):
+    import inspect
+    from functools import wraps
+
+    from starlette.concurrency import run_in_threadpool
+
+    call = inspect.unwrap(func)
+    if inspect.isgeneratorfunction(call) or inspect.isasyncgenfunction(call):
+        raise TypeError("Methods yielding results can't be cached.")
+
+    # 結果はパラメータのみから決まる必要がある
+    if len(inspect.signature(func).parameters) > 1:
+        raise TypeError("Methods with dependencies can't be cached.")
+
+    is_coroutine = asyncio.iscoroutinefunction(func)
+
+    @wraps(func)
+    async def wrapper(self):
+        # エンコード済みの結果を使い回せるよう、CachedResultとして保持する
+        async def execute():
+            if is_coroutine:
+                return CachedResult(await func(self))
+            return CachedResult(await run_in_threadpool(func, self))
+
+        return await cache.get_or_call(params_key(name, self), execute)
+
+    return wrapper
+
+
+def try_get_as_process_func(cls, processes: ProcessPool):
+    import inspect
+    from functools import wraps
+
+    if inspect.isfunction(cls) or not issubclass(cls, BaseModel):
+        raise TypeError("Only BaseModel methods can run in processes.")
+
+    call = getattr(cls, "__call__", None)
+    if call is None or not inspect.isfunction(call):
+        raise TypeError("Must be Callable.")
+
+    if inspect.iscoroutinefunction(call) or inspect.isasyncgenfunction(call):
+        raise TypeError("Methods run in processes must be sync functions.")
+
+    if inspect.isgeneratorfunction(call):
+        raise TypeError("Methods run in processes can't yield results.")
+
+    if len(inspect.signature(call).parameters) > 1:
+        raise TypeError("Methods run in processes can't take dependencies.")
+
+    @wraps(call)
+    async def wrapper(self):
+        return await processes.run(call_model, self)
+
+    wrapper.__name__ = cls.__name__
+    wrapper.__annotations__["self"] = cls
+    return wrapper
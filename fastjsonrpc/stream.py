@@ -0,0 +1,146 @@
+import codecs
+import json
+import re
+from typing import Any, List, Optional
+
+from . import exceptions
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+# 文字列は途中で切れている場合があるため、閉じていない引用符も拾う
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|["\[\]{},]', re.DOTALL)
+# 数値の続きになりうる文字
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+RETRY_THRESHOLD = 1 << 16
+
+
+class BatchStreamParser:
+    """Split a json array into its elements while it is being received.
+
+    Each element is decoded with the json scanner as soon as it is complete, so the
+    whole array is never held in memory.
+
+        parser = BatchStreamParser()
+        for chunk in chunks:
+            for member in parser.feed(chunk):
+                ...
+        for member in parser.close():
+            ...
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._scanner = json.JSONDecoder()
+        self._text = ""
+        self._opened = False
+        self._closed = False
+        self._expect_value = True
+        self._retry_size = 0
+        self.count = 0
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Consume a chunk and return the elements completed by it."""
+        try:
+            self._text += self._decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            raise exceptions.ParseError(str(e)) from e
+
+        # 大きな要素は受信済みの量が倍になるまで読み直さない
+        if len(self._text) < self._retry_size:
+            return []
+
+        return self._parse()
+
+    def close(self) -> List[Any]:
+        """Return the remaining elements. Raises ParseError if the array is incomplete."""
+        members = self._parse()
+        if not self._closed:
+            raise exceptions.ParseError("Unterminated batch.")
+        return members
+
+    def _parse(self) -> List[Any]:
+        members: List[Any] = []
+        pos = self._parse_text(self._text, members)
+        self._text = self._text[pos:]
+        if len(self._text) > RETRY_THRESHOLD:
+            self._retry_size = len(self._text) * 2
+        else:
+            self._retry_size = 0
+        return members
+
+    def _parse_text(self, text: str, members: List[Any]) -> int:
+        pos = _WHITESPACE.match(text, 0).end()
+        size = len(text)
+
+        if not self._opened:
+            if pos == size:
+                return pos
+            if text[pos] != "[":
+                raise exceptions.ParseError("batch must be an array.")
+            self._opened = True
+            pos = _WHITESPACE.match(text, pos + 1).end()
+
+        while pos < size:
+            if self._closed:
+                raise exceptions.ParseError("Extra data after the batch.")
+
+            char = text[pos]
+            if not self._expect_value:
+                if char == ",":
+                    self._expect_value = True
+                elif char == "]":
+                    self._closed = True
+                else:
+                    raise exceptions.ParseError("Expecting ',' delimiter in the batch.")
+                pos = _WHITESPACE.match(text, pos + 1).end()
+                continue
+
+            # 空の配列
+            if char == "]" and not self.count:
+                self._closed = True
+                pos = _WHITESPACE.match(text, pos + 1).end()
+                continue
+
+            try:
+                member, end = self._scanner.raw_decode(text, pos)
+            except json.JSONDecodeError as e:
+                if self._find_end(text, pos) is None:
+                    # 要素の続きを待つ
+                    return pos
+                raise exceptions.ParseError(str(e)) from e
+
+            # 数値などは末尾で途切れている可能性がある
+            if end == size and char not in '"[{':
+                return pos
+            # 数値は小数点や指数の前で分割されていても、続きを待ってから読む
+            if char in "-0123456789" and text[end] in _NUMBER_CHARS:
+                return pos
+
+            members.append(member)
+            self.count += 1
+            self._expect_value = False
+            pos = _WHITESPACE.match(text, end).end()
+
+        return pos
+
+    @staticmethod
+    def _find_end(text: str, pos: int) -> Optional[int]:
+        """Return the end of the element starting at `pos`, or None if incomplete."""
+        depth = 0
+        for m in _TOKEN.finditer(text, pos):
+            token = m.group()
+            if token == '"':
+                return None
+            if token in ("[", "{"):
+                depth += 1
+            elif token in ("]", "}", ","):
+                if depth == 0:
+                    return m.start()
+                if token != ",":
+                    depth -= 1
+            if depth == 0 and token[0] in '"]}':
+                return m.end()
+        return None
@@ -1,9 +1,13 @@
-import json
-from typing import Union
+import asyncio
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import Optional, Union
 
-from starlette.websockets import WebSocket
+from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from fastjsonrpc.localclient import LocalClient, StateLocalClient
+from fastjsonrpc.codec import BINARY_CODECS, JsonCodec
+from fastjsonrpc.compression import DeflateCompressor, WebSocketCompression
+from fastjsonrpc.handler import RpcSession, empty_receive
 from fastjsonrpc.schemas import RpcResponse, RpcResponseError
 
 config = {
@@ -15,25 +19,126 @@ config = {
 
 class JsonRpcWebSocket(WebSocket):
     CLOSE_ON_ERROR: bool = True
+    MAX_IN_FLIGHT: int = 32
 
     @staticmethod
-    def get_websocket(self: "JsonRpcRouter", websocket: WebSocket, use_state=False):
-        return JsonRpcWebSocket(
-            websocket.scope, websocket.receive, websocket.send, self, use_state
+    def get_websocket(
+        self: "JsonRpcRouter",
+        websocket: WebSocket,
+        use_state=False,
+        subprotocol: Optional[str] = None,
+    ):
+        rpc_websocket = JsonRpcWebSocket(
+            websocket.scope,
+            websocket.receive,
+            websocket.send,
+            self,
+            use_state,
+            subprotocol,
         )
+        # 既にacceptされたwebsocketから作られた場合も送受信できるようにする
+        rpc_websocket.client_state = websocket.client_state
+        rpc_websocket.application_state = websocket.application_state
+        return rpc_websocket
 
-    def __init__(self, scope, receive, send, rpc_router, use_state=False) -> None:
+    def __init__(
+        self,
+        scope,
+        receive,
+        send,
+        rpc_router,
+        use_state=False,
+        subprotocol: Optional[str] = None,
+    ) -> None:
         super().__init__(scope, receive, send)
 
+        self.route = self._find_entrypoint(rpc_router, scope)
         self.entrypoint = self._analize_entrypoint_path(scope, rpc_router)
-        if use_state:
-            self.dispacher = StateLocalClient(scope)
+        self._rpc_scope = self._create_rpc_scope(scope, self.entrypoint, use_state)
+        self._session = RpcSession(self.route._handlers, self.route.path)
+        self.use_subprotocol(subprotocol)
+
+    def select_subprotocol(self) -> Optional[str]:
+        """Return the first subprotocol requested by the client that is supported.
+
+        Subprotocols whose codec library is not installed are skipped, and
+        `jsonrpc.deflate` is only selected if the router has a compression policy.
+        """
+        compression = self.route._websocket_compression
+        for name in self.scope.get("subprotocols", []):
+            if name == WebSocketCompression.SUBPROTOCOL:
+                if compression is not None and compression.accepts(self.scope):
+                    return name
+                continue
+            if name not in BINARY_CODECS:
+                continue
+            try:
+                BINARY_CODECS[name]()
+            except ImportError:
+                continue
+            return name
+        return None
+
+    def use_subprotocol(self, subprotocol: Optional[str]) -> None:
+        """Encode messages with the codec of `subprotocol` (the router's codec if None)."""
+        codec: JsonCodec = self.route._codec
+        self.compressor: Optional[DeflateCompressor] = None
+        if subprotocol == WebSocketCompression.SUBPROTOCOL:
+            if self.route._websocket_compression is None:
+                raise ValueError("The router has no websocket compression policy.")
+            self.compressor = self.route._websocket_compression.create_compressor()
+        elif subprotocol is not None:
+            if subprotocol not in BINARY_CODECS:
+                raise ValueError(f"Unknown subprotocol: {subprotocol}")
+            codec = BINARY_CODECS[subprotocol]()
+
+        self.subprotocol = subprotocol
+        self.codec = codec
+        self._rpc_scope["_jsonrpc_codec"] = codec
+
+    async def accept(self, subprotocol: Optional[str] = None) -> None:
+        """Accept the connection with a binary subprotocol requested by the client.
+
+        Without `subprotocol`, the first supported one of `jsonrpc.msgpack`,
+        `jsonrpc.cbor` and `jsonrpc.deflate` is selected. Otherwise messages are
+        json text frames.
+        """
+        if subprotocol is None:
+            subprotocol = self.select_subprotocol()
+        self.use_subprotocol(subprotocol)
+        await super().accept(subprotocol)
+
+    async def receive_message(self) -> Union[str, bytes]:
+        """Receive a text or binary frame.
+
+        A frame of the other type than the codec expects is returned as is, so
+        that decoding it answers a parse error.
+        """
+        message = await self.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        # receive_text/receive_bytesは種別の違うフレームでKeyErrorになる
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        return message.get("text") or ""
+
+    async def send_message(self, body: bytes) -> None:
+        if self.compressor is not None:
+            compressed = self.route._websocket_compression.compress(
+                self.compressor, body
+            )
+            if compressed is not None:
+                await self.send_bytes(compressed)
+                return
+
+        if self.codec.binary:
+            await self.send_bytes(body)
         else:
-            self.dispacher = LocalClient(scope)
+            await self.send_text(body.decode())
 
     @classmethod
     def _analize_entrypoint_path(cls, scope, rpc_router):
-        entrypoint = cls._filter_entrypoint(rpc_router, scope["router"])[0]
+        entrypoint = cls._find_entrypoint(rpc_router, scope)
         path = entrypoint.path.split("/")[1:-1]
         entrypoint_path = "/" + "/".join(path)
         if len(entrypoint_path) > 1:
@@ -41,6 +146,20 @@ class JsonRpcWebSocket(WebSocket):
 
         return entrypoint_path
 
+    @classmethod
+    def _find_entrypoint(cls, rpc_router, scope):
+        """The entrypoint of the include of `rpc_router` serving `scope`.
+
+        If the router is included more than once, the one with the longest prefix
+        of the path of `scope` is used, otherwise the first one.
+        """
+        entrypoints = cls._filter_entrypoint(rpc_router, scope["router"])
+        path = scope.get("path", "")
+        matched = [e for e in entrypoints if path.startswith(e.path)]
+        if not matched:
+            return entrypoints[0]
+        return max(matched, key=lambda e: len(e.path))
+
     @staticmethod
     def _filter_entrypoint(rpc_router, router):
         entrypoint = rpc_router.routes[0]
@@ -50,30 +169,122 @@ class JsonRpcWebSocket(WebSocket):
 
         return list(filter(filter_jsonrpc_router, router.routes))
 
+    @staticmethod
+    def _create_rpc_scope(scope, entrypoint, use_state=False):
+        """Create the scope template that rpc methods are called with.
+
+        Methods are called directly, so the template is only copied per message.
+        With `use_state`, headers and state are shared with the websocket.
+        """
+        rpc_scope = {
+            "type": "http",
+            "method": "POST",
+            "path": entrypoint,
+            "root_path": scope.get("root_path", ""),
+            "query_string": b"",
+            "headers": [],
+        }
+        for key in ("app", "router"):
+            if key in scope:
+                rpc_scope[key] = scope[key]
+
+        if use_state:
+            rpc_scope["headers"] = scope.get("headers", [])
+            rpc_scope["state"] = scope.setdefault("state", {})
+
+        return rpc_scope
+
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__()
         cls.__config__ = kwargs.get("config", {})
 
+    async def _dispatch(self, dispatch, data) -> Optional[bytes]:
+        async with AsyncExitStack() as stack:
+            scope = dict(self._rpc_scope)
+            scope["fastapi_astack"] = stack
+            body, background = await dispatch(scope, empty_receive, data)
+
+        if background is not None:
+            await background()
+
+        return body
+
     async def post(self, data):
-        data = json.dumps(data)
-        result = await self.dispacher.call(
-            method="POST", url=self.entrypoint, data=data
-        )
-        body = result[1]["body"]
-        return json.loads(body)
+        dispatch = partial(self.route.dispatch_body, session=self._session)
+        body = await self._dispatch(dispatch, data)
+        if body is None:
+            return None
+        return self.codec.loads(body)
 
     async def request_rpc_text(
-        self, rpc_request_text
-    ) -> Union[RpcResponse, RpcResponseError]:
-        result = await self.dispacher.call(
-            method="POST", url=self.entrypoint, data=rpc_request_text
+        self, rpc_request_text, on_partial=None
+    ) -> Optional[bytes]:
+        """Answer a message. Items of streamed results are passed to `on_partial`."""
+        dispatch = partial(
+            self.route.dispatch, on_partial=on_partial, session=self._session
         )
-        body = result[1]["body"]
-        return body
+        return await self._dispatch(dispatch, rpc_request_text)
 
     async def receive_rpc_response(
         self,
-    ) -> Union[RpcResponse, RpcResponseError]:
-        data = await self.receive_text()
+    ) -> Optional[Union[RpcResponse, RpcResponseError]]:
+        """Answer a message. Returns None for notifications."""
+        data = await self.receive_message()
         res_body = await self.request_rpc_text(data)
-        return json.loads(res_body)
+        if res_body is None:
+            return None
+        return self.codec.loads(res_body)
+
+    async def serve(self, max_in_flight: Optional[int] = None) -> None:
+        """Answer messages until the websocket is disconnected.
+
+        Up to `max_in_flight` calls run concurrently and each response is sent as
+        soon as it completes, so responses may be out of order and are matched by id.
+        While the limit is reached, no more messages are received.
+
+        Methods returning generators send each item as a partial frame
+        (`{"jsonrpc": "2.0", "partial": item, "id": id}`) followed by a response
+        with `null` result, or an error response if the method fails.
+        """
+        if max_in_flight is None:
+            max_in_flight = self.MAX_IN_FLIGHT
+        elif max_in_flight < 1:
+            raise ValueError("'max_in_flight' must be greater than 0.")
+
+        semaphore = asyncio.Semaphore(max_in_flight)
+        send_lock = asyncio.Lock()
+        tasks = set()
+
+        async def send(body: bytes):
+            async with send_lock:
+                await self.send_message(body)
+
+        async def execute(data):
+            try:
+                body = await self.request_rpc_text(data, on_partial=send)
+                if body is not None:
+                    await send(body)
+            finally:
+                semaphore.release()
+
+        def done(task: asyncio.Task):
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                self.route._error_log.log(task.exception())
+
+        try:
+            while True:
+                await semaphore.acquire()
+                try:
+                    data = await self.receive_message()
+                except WebSocketDisconnect:
+                    break
+
+                task = asyncio.create_task(execute(data))
+                tasks.add(task)
+                task.add_done_callback(done)
+        finally:
+            # 切断後は応答を返せないため、実行中の呼び出しを取り消す
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,63 @@
+import json
+
+from benchmarks.bench import SCENARIOS, compare, load_baseline, main, run, summarize
+
+
+def test_scenarios():
+    results = run(list(SCENARIOS), iterations=3, warmup=1, alloc_iterations=1, repeat=2)
+    assert list(results) == list(SCENARIOS)
+    for result in results.values():
+        assert result["ops_per_sec"] > 0
+        assert result["spread"] >= 0
+        assert result["p50_us"] <= result["p99_us"]
+        assert result["peak_bytes"] > 0
+
+
+def test_summarize():
+    runs = [
+        {"ops_per_sec": ops, "p50_us": 1.0, "p99_us": 2.0, "peak_bytes": 10}
+        for ops in [90.0, 100.0, 110.0]
+    ]
+    assert summarize(runs) == {
+        "ops_per_sec": 100.0,
+        "spread": 0.2,
+        "p50_us": 1.0,
+        "p99_us": 2.0,
+        "peak_bytes": 10,
+    }
+
+
+def test_compare():
+    result = {
+        "ops_per_sec": 80.0,
+        "spread": 0.0,
+        "p50_us": 1.0,
+        "p99_us": 1.0,
+        "peak_bytes": 1,
+    }
+    baseline = {"a": dict(result, ops_per_sec=100.0)}
+    assert compare({"a": result}, baseline, threshold=0.3) == []
+    assert compare({"a": result}, baseline, threshold=0.1) == ["a"]
+    assert compare({"b": result}, baseline, threshold=0.1) == []
+
+    # 繰り返し実行のばらつきの分だけ許容する
+    noisy = {"a": dict(result, ops_per_sec=100.0, spread=0.15)}
+    assert compare({"a": result}, noisy, threshold=0.1) == []
+    assert compare({"a": dict(result, spread=0.15)}, baseline, threshold=0.1) == []
+
+
+def test_load_baseline(tmp_path):
+    path = tmp_path / "baseline.json"
+    assert load_baseline(str(path)) == {}
+
+    path.write_text(json.dumps({"machine": "other", "scenarios": {"a": {}}}))
+    assert load_baseline(str(path)) == {}
+
+
+def test_main(tmp_path):
+    baseline = str(tmp_path / "baseline.json")
+    args = ["-k", "http_single", "-n", "3", "--warmup", "1", "--alloc-iterations", "1"]
+    args += ["--repeat", "2"]
+    assert main(args + ["--baseline", baseline, "--save"]) == 0
+    assert set(load_baseline(baseline)) == {"http_single", "http_single_async"}
+    assert main(args + ["--baseline", baseline, "--check", "--threshold", "1"]) == 0
@@ -0,0 +1,237 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.cache import ResultCache, params_key
+from fastjsonrpc.websocket import JsonRpcWebSocket
+from tests import OK, REQ, as_async
+
+
+def test_params_key():
+    class Params(BaseModel):
+        a: int
+        b: dict
+
+    key = params_key("m", Params(a=1, b={"x": 1, "y": 2}))
+    assert key == params_key("m", Params(b={"y": 2, "x": 1}, a=1))
+    assert key != params_key("n", Params(a=1, b={"x": 1, "y": 2}))
+    assert key != params_key("m", Params(a=2, b={"x": 1, "y": 2}))
+
+
+@as_async
+async def test_result_cache():
+    with pytest.raises(ValueError, match="maxsize"):
+        ResultCache(maxsize=0)
+
+    cache = ResultCache(maxsize=2)
+    calls = []
+
+    def create(value):
+        async def func():
+            calls.append(value)
+            return value
+
+        return func
+
+    assert await cache.get_or_call("a", create(1)) == 1
+    assert await cache.get_or_call("a", create(2)) == 1
+    assert await cache.get_or_call("b", create(2)) == 2
+    assert await cache.get_or_call("a", create(3)) == 1
+    # 最も使われていないbが追い出される
+    assert await cache.get_or_call("c", create(3)) == 3
+    assert await cache.get_or_call("b", create(4)) == 4
+    assert calls == [1, 2, 3, 4]
+    assert cache.metrics() == {"hits": 2, "misses": 4, "evictions": 2, "size": 2}
+
+
+@as_async
+async def test_result_cache_ttl(monkeypatch):
+    from fastjsonrpc import cache as module
+
+    now = 0.0
+    monkeypatch.setattr(module.time, "monotonic", lambda: now)
+    cache = ResultCache(ttl=10)
+
+    async def func():
+        return now
+
+    assert await cache.get_or_call("a", func) == 0
+    now = 9.9
+    assert await cache.get_or_call("a", func) == 0
+    now = 10.0
+    assert await cache.get_or_call("a", func) == 10.0
+
+
+@as_async
+async def test_result_cache_single_flight():
+    cache = ResultCache()
+    calls = 0
+
+    async def func():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    assert (
+        await asyncio.gather(*(cache.get_or_call("a", func) for _ in range(5)))
+        == [1] * 5
+    )
+    assert calls == 1
+    assert cache.metrics()["misses"] == 1
+    assert cache.metrics()["hits"] == 4
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("fail")
+
+    results = await asyncio.gather(
+        *(cache.get_or_call("b", fail) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(x, ValueError) for x in results)
+    assert len(cache) == 1
+
+
+@as_async
+async def test_result_cache_leader_cancelled():
+    cache = ResultCache()
+    calls = 0
+
+    async def func():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    leader = asyncio.ensure_future(cache.get_or_call("a", func))
+    await asyncio.sleep(0)
+    followers = [asyncio.ensure_future(cache.get_or_call("a", func)) for _ in range(2)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    # 待機していた呼び出しは取り消されず、一つが実行し直す
+    assert await asyncio.gather(*followers) == [2, 2]
+    assert leader.cancelled()
+    assert calls == 2
+
+    # 待機者自身の取り消しは他に影響しない
+    leader = asyncio.ensure_future(cache.get_or_call("b", func))
+    follower = asyncio.ensure_future(cache.get_or_call("b", func))
+    await asyncio.sleep(0)
+    follower.cancel()
+    assert await leader == 3
+    assert follower.cancelled()
+
+
+def create_app():
+    api = JsonRpcRouter()
+    calls = []
+    shared = ResultCache(maxsize=10)
+
+    @api.post(cache=True)
+    class GetConfig(BaseModel):
+        key: str
+
+        def __call__(self):
+            calls.append(self.key)
+            return {"key": self.key}
+
+    @api.post(cache=shared)
+    class Add(BaseModel):
+        a: int
+        b: int
+
+        async def __call__(self):
+            calls.append(self.a + self.b)
+            return self.a + self.b
+
+    app = FastAPI()
+    app.include_router(api)
+    return app, api, calls, shared
+
+
+def test_http_cache():
+    app, api, calls, shared = create_app()
+    client = TestClient(app)
+
+    for id in [1, 2]:
+        response = client.post("/", json=REQ("get_config", {"key": "a"}, id=id))
+        assert response.json() == OK(id=id, result={"key": "a"})
+    response = client.post("/", json=REQ("get_config", {"key": "b"}, id=3))
+    assert response.json() == OK(id=3, result={"key": "b"})
+
+    batch = [REQ("add", {"a": 1, "b": 2}, id=1), REQ("add", {"b": 2, "a": 1}, id=2)]
+    response = client.post("/", json=batch)
+    assert sorted(response.json(), key=lambda x: x["id"]) == [
+        OK(id=1, result=3),
+        OK(id=2, result=3),
+    ]
+
+    assert calls == ["a", "b", 3]
+    assert api.caches["get_config"].metrics()["hits"] == 1
+    assert api.caches["add"] is shared
+    assert shared.metrics()["hits"] == 1
+
+
+@as_async
+async def test_websocket_cache():
+    app, api, calls, shared = create_app()
+    scope = {"type": "websocket", "app": app, "router": app.router}
+    websocket = JsonRpcWebSocket(scope, None, None, api)
+
+    for id in [1, 2]:
+        body = await websocket.request_rpc_text(
+            json.dumps(REQ("get_config", {"key": "a"}, id=id))
+        )
+        assert json.loads(body) == OK(id=id, result={"key": "a"})
+    assert calls == ["a"]
+
+
+def test_cache_validation():
+    api = JsonRpcRouter()
+
+    class Depends(BaseModel):
+        def __call__(self, request: Request):
+            ...
+
+    class Generator(BaseModel):
+        def __call__(self):
+            yield 1
+
+    with pytest.raises(TypeError, match="dependencies"):
+        api.post(cache=True)(Depends)
+
+    with pytest.raises(TypeError, match="yielding"):
+        api.post(cache=True)(Generator)
+
+
+def test_encoded_result_cache(monkeypatch):
+    from fastjsonrpc import handler
+
+    app, api, calls, shared = create_app()
+    client = TestClient(app)
+
+    serialized = []
+    serialize_response = handler.serialize_response
+
+    async def spy(**kwargs):
+        serialized.append(kwargs["response_content"])
+        return await serialize_response(**kwargs)
+
+    monkeypatch.setattr(handler, "serialize_response", spy)
+
+    for id in [1, 2, 3]:
+        response = client.post("/", json=REQ("get_config", {"key": "a"}, id=id))
+        assert response.json() == OK(id=id, result={"key": "a"})
+    assert serialized == [{"key": "a"}]
+
+    response = client.post("/get_config", json={"key": "a"})
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {"key": "a"}
+    assert serialized == [{"key": "a"}]
+    assert calls == ["a"]
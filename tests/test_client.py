@@ -0,0 +1,395 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import Depends, FastAPI
+from pydantic import BaseModel
+from starlette.websockets import WebSocket
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.exceptions import (
+    InternalServerError,
+    InvalidParamsError,
+    MethodNotFoundError,
+    RpcBaseError,
+    RpcError,
+)
+from tests import _sample_app_router, as_async
+
+
+class Conflict(RpcError):
+    code = 409
+    message = "Conflict."
+
+
+def test_error_from_dict():
+    err = RpcBaseError.from_dict(Conflict("x").to_dict(id=1)["error"])
+    assert type(err) is Conflict
+    assert err.data == "x"
+
+    err = RpcBaseError.from_dict({"code": 1, "message": "unknown", "data": None})
+    assert type(err) is RpcError
+    assert err.to_dict()["error"] == {"code": 1, "message": "unknown", "data": None}
+
+
+@as_async
+async def test_local_client():
+    app, rpc = _sample_app_router()
+    client = rpc.get_client(app)
+    assert await client.call("echo", msg="hello") == "hello"
+
+    with pytest.raises(RpcError) as e:
+        await client.call("rpc_error", msg="err!")
+    assert e.value.data == "err!"
+
+    with pytest.raises(InternalServerError):
+        await client.call("error", msg="err!")
+
+    with pytest.raises(InvalidParamsError):
+        await client.call("echo")
+
+    with pytest.raises(MethodNotFoundError):
+        await client.call("xxx")
+
+    results = await client.batch([("echo", {"msg": "a"}), ("xxx", {})])
+    assert results[0] == "a"
+    assert isinstance(results[1], MethodNotFoundError)
+
+
+@as_async
+async def test_local_client_prefix():
+    rpc = JsonRpcRouter()
+    called = []
+
+    async def get_db():
+        yield "db"
+        called.append("closed")
+
+    @rpc.post()
+    class Items(BaseModel):
+        size: int
+
+        def __call__(self, db=Depends(get_db)):
+            yield from [db] * self.size
+
+    @rpc.post()
+    class Log(BaseModel):
+        msg: str
+
+        def __call__(self):
+            called.append(self.msg)
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+    client = rpc.get_client(app)
+
+    assert await client.call("items", size=2) == ["db", "db"]
+    assert called == ["closed"]
+
+    assert await client.notify("log", msg="hello") is None
+    await asyncio.sleep(0.01)
+    assert called == ["closed", "hello"]
+
+
+def create_http_client(app, **kwargs):
+    httpx = pytest.importorskip("httpx")
+    from fastjsonrpc.client import HttpRpcClient
+
+    class CountingTransport(httpx.ASGITransport):
+        requests = 0
+
+        async def handle_async_request(self, request):
+            CountingTransport.requests += 1
+            return await super().handle_async_request(request)
+
+    transport = CountingTransport(app=app)
+    client = HttpRpcClient("http://testserver/", transport=transport, **kwargs)
+    return client, transport
+
+
+@as_async
+async def test_http_client():
+    app, rpc = _sample_app_router()
+    client, transport = create_http_client(app)
+    async with client:
+        assert await client.call("echo", msg="hello") == "hello"
+
+        with pytest.raises(RpcError) as e:
+            await client.call("rpc_error", msg="err!")
+        assert e.value.data == "err!"
+
+        with pytest.raises(MethodNotFoundError):
+            await client.call("xxx")
+
+        assert await client.notify("echo", msg="hello") is None
+
+        results = await client.batch([("echo", {"msg": "a"}), ("xxx", {})])
+        assert results[0] == "a"
+        assert isinstance(results[1], MethodNotFoundError)
+        assert await client.batch([]) == []
+
+    assert transport.requests == 5
+
+
+@as_async
+async def test_http_client_auto_batching():
+    app, rpc = _sample_app_router()
+    client, transport = create_http_client(app, batch_window=0.01, max_batch_size=3)
+    async with client:
+        calls = [client.call("echo", msg=str(i)) for i in range(4)]
+        calls.append(client.call("xxx"))
+        calls.append(client.notify("echo", msg="x"))
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        assert results[:4] == ["0", "1", "2", "3"]
+        assert isinstance(results[4], MethodNotFoundError)
+        assert results[5] is None
+        # 3件ずつのバッチにまとめられる
+        assert transport.requests == 2
+
+        assert await client.call("echo", msg="alone") == "alone"
+        assert transport.requests == 3
+
+        client.flush()
+        pending = asyncio.ensure_future(client.call("echo", msg="closing"))
+        await asyncio.sleep(0)
+
+    assert await pending == "closing"
+
+
+def create_websocket_app():
+    rpc = JsonRpcRouter()
+    running = []
+
+    @rpc.post()
+    class Sleep(BaseModel):
+        seconds: float
+
+        async def __call__(self):
+            running.append(self.seconds)
+            Sleep.max_running = max(getattr(Sleep, "max_running", 0), len(running))
+            await asyncio.sleep(self.seconds)
+            running.remove(self.seconds)
+            return self.seconds
+
+    @rpc.post()
+    class Count(BaseModel):
+        n: int
+
+        async def __call__(self):
+            for i in range(self.n):
+                yield i
+
+    @rpc.post()
+    class Fail(BaseModel):
+        def __call__(self):
+            raise Conflict("x")
+
+    @rpc.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        await rpc.get_websocket(websocket).serve()
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+    return app, Sleep
+
+
+@as_async
+async def test_websocket_client():
+    from fastjsonrpc.client import ASGIWebSocketTransport, WebSocketRpcClient
+
+    app, Sleep = create_websocket_app()
+    transport = ASGIWebSocketTransport(app, "/jsonrpc/ws")
+    async with WebSocketRpcClient(transport, max_in_flight=2) as client:
+        results = await asyncio.gather(
+            client.call("sleep", seconds=0.03),
+            client.call("sleep", seconds=0.02),
+            client.call("sleep", seconds=0.01),
+        )
+        assert results == [0.03, 0.02, 0.01]
+        assert Sleep.max_running == 2
+
+        assert await client.call("count", n=3) == [0, 1, 2]
+
+        with pytest.raises(Conflict):
+            await client.call("fail")
+
+        results = await client.batch([("sleep", {"seconds": 0}), ("xxx", {})])
+        assert results[0] == 0
+        assert isinstance(results[1], MethodNotFoundError)
+
+        assert await client.notify("sleep", seconds=0) is None
+        assert client.in_flight == 0
+
+    with pytest.raises(ConnectionError):
+        await client.call("sleep", seconds=0)
+
+
+def test_websocket_client_created_outside_loop():
+    from fastjsonrpc.client import ASGIWebSocketTransport, WebSocketRpcClient
+
+    app, _ = create_websocket_app()
+    # 同期コードで作成し、別に作られたイベントループで使う
+    client = WebSocketRpcClient(ASGIWebSocketTransport(app, "/jsonrpc/ws"))
+    assert client._window is None
+
+    async def main():
+        async with client:
+            return await client.call("sleep", seconds=0)
+
+    assert asyncio.run(main()) == 0
+
+
+@as_async
+async def test_websocket_client_reconnect():
+    from fastjsonrpc.client import ASGIWebSocketTransport, WebSocketRpcClient
+
+    app, _ = create_websocket_app()
+    transport = ASGIWebSocketTransport(app, "/jsonrpc/ws")
+    attempts = []
+
+    async def connect():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) in (2, 3):
+            raise OSError("refused")
+        return await transport()
+
+    client = WebSocketRpcClient(connect, backoff=0.01)
+    async with client:
+        pending = asyncio.ensure_future(client.call("sleep", seconds=1))
+        await asyncio.sleep(0.01)
+        # 通信が切断されると、応答待ちの呼び出しは失敗する
+        await client.connection.close()
+        with pytest.raises(ConnectionError):
+            await pending
+
+        assert await client.call("sleep", seconds=0) == 0
+        assert client.connects == 2
+        assert len(attempts) == 4
+        # 接続に失敗するたびに待ち時間が倍になる
+        assert attempts[3] - attempts[2] >= 0.02 > attempts[2] - attempts[1] >= 0.01
+
+
+@as_async
+async def test_websocket_client_without_reconnect():
+    from fastjsonrpc.client import WebSocketRpcClient
+
+    async def connect():
+        raise OSError("refused")
+
+    client = WebSocketRpcClient(connect, reconnect=False)
+    with pytest.raises(OSError):
+        await client.call("sleep", seconds=0)
+    await client.close()
+
+
+class StubConnection:
+    """Answer each frame with `reply(frame)`, or not at all if it returns None."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.closed = False
+        self._frames = asyncio.Queue()
+
+    async def send(self, data):
+        frame = self.reply(json.loads(data))
+        if frame is not None:
+            await self._frames.put(frame)
+
+    async def recv(self):
+        frame = await self._frames.get()
+        if frame is ConnectionError:
+            raise ConnectionError("closed")
+        return frame
+
+    async def close(self):
+        self.closed = True
+        await self._frames.put(ConnectionError)
+
+
+@as_async
+async def test_websocket_client_error_without_id():
+    from fastjsonrpc.client import WebSocketRpcClient
+    from fastjsonrpc.exceptions import ParseError
+
+    def reply(frame):
+        return json.dumps(ParseError("bad").to_dict(id=None))
+
+    async def connect():
+        return StubConnection(reply)
+
+    async with WebSocketRpcClient(connect) as client:
+        with pytest.raises(ParseError):
+            await asyncio.wait_for(client.call("echo", msg="a"), 1)
+
+        results = await asyncio.wait_for(client.batch([("echo", {}), ("echo", {})]), 1)
+        assert all(isinstance(x, ParseError) for x in results)
+
+
+@as_async
+async def test_websocket_client_timeout():
+    from fastjsonrpc.client import WebSocketRpcClient
+
+    async def connect():
+        return StubConnection(lambda frame: None)
+
+    with pytest.raises(ValueError):
+        WebSocketRpcClient(connect, timeout=0)
+
+    async with WebSocketRpcClient(connect, timeout=0.01) as client:
+        with pytest.raises(asyncio.TimeoutError):
+            await client.call("echo", msg="a")
+        with pytest.raises(asyncio.TimeoutError):
+            await client.batch([("echo", {})])
+        assert client.in_flight == 0
+        assert not client._futures
+
+
+@as_async
+async def test_websocket_client_malformed_frame(caplog):
+    from fastjsonrpc.client import WebSocketRpcClient
+    from fastjsonrpc.exceptions import ParseError
+
+    replies = iter(["not json", "[1]", None])
+    connections = []
+
+    def reply(frame):
+        return next(replies) or json.dumps(
+            {"jsonrpc": "2.0", "result": 1, "id": frame["id"]}
+        )
+
+    async def connect():
+        connections.append(StubConnection(reply))
+        return connections[-1]
+
+    async with WebSocketRpcClient(connect) as client:
+        for _ in range(2):
+            with pytest.raises(ParseError):
+                await asyncio.wait_for(client.call("echo"), 1)
+        # 不正なフレームでは接続し直さない
+        assert await asyncio.wait_for(client.call("echo"), 1) == 1
+        assert len(connections) == 1
+    assert "Malformed websocket rpc frame" in caplog.text
+
+
+@as_async
+async def test_websocket_client_closes_lost_connection():
+    from fastjsonrpc.client import WebSocketRpcClient
+
+    connections = []
+
+    class BrokenConnection(StubConnection):
+        async def recv(self):
+            if len(connections) == 1:
+                raise RuntimeError("broken")
+            return await super().recv()
+
+    async def connect():
+        connections.append(BrokenConnection(lambda frame: None))
+        return connections[-1]
+
+    async with WebSocketRpcClient(connect, backoff=0.01):
+        while len(connections) < 2:
+            await asyncio.sleep(0.01)
+        assert connections[0].closed
+        assert not connections[1].closed
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.codec import JsonCodec, OrjsonCodec, UjsonCodec, get_codec
+from tests import OK, REQ
+
+
+def codecs():
+    yield JsonCodec()
+
+    try:
+        yield OrjsonCodec()
+    except ImportError:
+        ...
+
+    try:
+        yield UjsonCodec()
+    except ImportError:
+        ...
+
+
+@pytest.mark.parametrize("codec", list(codecs()), ids=lambda x: x.name)
+def test_codec(codec: JsonCodec):
+    content = {"msg": "こんにちは", "values": [1, 2.5, None, True], "id": 1}
+    encoded = codec.dumps(content)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == content
+    assert codec.loads(encoded) == content
+    assert codec.loads(encoded.decode()) == content
+
+    # fallback to the standard library
+    for value in [2**64 + 1, -(2**64) - 1, 123456789012345678901234]:
+        decoded = codec.loads(str(value).encode())
+        assert type(decoded) is int and decoded == value
+    decoded = codec.loads(b'{"id":123456789012345678901234}')
+    assert decoded == {"id": 123456789012345678901234}
+    assert type(decoded["id"]) is int
+    assert codec.dumps(2**64) == b"18446744073709551616"
+
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads(b"")
+
+
+@pytest.mark.parametrize("codec", list(codecs())[1:], ids=lambda x: x.name)
+def test_codec_no_fallback(codec: JsonCodec, monkeypatch):
+    calls = []
+
+    def loads(self, data):
+        calls.append(data)
+        return json.loads(data)
+
+    monkeypatch.setattr(JsonCodec, "loads", loads)
+
+    # 標準ライブラリでの読み直しは64ビットを超える整数の場合のみ
+    for data in [b"NaN", b"Infinity", b"garbage", b'{"id": 1']:
+        with pytest.raises(json.JSONDecodeError):
+            codec.loads(data)
+    assert calls == []
+
+    assert codec.loads(b"[18446744073709551617]") == [2**64 + 1]
+    assert len(calls) == 1
+
+
+def test_get_codec():
+    assert isinstance(get_codec("json"), JsonCodec)
+
+    codec = JsonCodec()
+    assert get_codec(codec) is codec
+
+    try:
+        import orjson  # noqa
+    except ImportError:  # pragma: no cover
+        assert get_codec().name == "json"
+    else:
+        assert get_codec().name == "orjson"
+
+    with pytest.raises(ValueError, match="Unknown codec"):
+        get_codec("xxx")
+
+    with pytest.raises(TypeError):
+        get_codec(1)  # type: ignore
+
+
+@pytest.mark.parametrize("codec", list(codecs()), ids=lambda x: x.name)
+def test_router_codec(codec: JsonCodec):
+    api = JsonRpcRouter(codec=codec)
+
+    @api.post()
+    class Echo(BaseModel):
+        msg: str
+
+        def __call__(self):
+            return self.msg
+
+    app = FastAPI()
+    app.include_router(api)
+    client = TestClient(app)
+
+    assert api._codec is codec
+    response = client.post("/", data=codec.dumps(REQ("echo", {"msg": "あ"}, id=1)))
+    assert response.content == '{"jsonrpc":"2.0","result":"あ","id":1}'.encode()
+    assert response.json() == OK(id=1, result="あ")
+
+    response = client.post("/echo", data=codec.dumps({"msg": "あ"}))
+    assert response.content == '"あ"'.encode()
@@ -0,0 +1,248 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from starlette.websockets import WebSocket
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.compression import (
+    DeflateCompressor,
+    DeflateDecompressor,
+    HttpCompression,
+    WebSocketCompression,
+)
+from tests import OK, REQ
+
+
+def test_deflate_context_is_kept():
+    compressor = DeflateCompressor()
+    decompressor = DeflateDecompressor()
+    message = json.dumps(OK(id=1, result=list(range(1000)))).encode()
+    first = compressor.compress(message)
+    second = compressor.compress(message)
+    # 2回目は1回目のメッセージを参照できる
+    assert len(second) < len(first) < len(message)
+    assert decompressor.decompress(first) == message
+    assert decompressor.decompress(second) == message
+    assert compressor.bytes_in == len(message) * 2
+
+
+def test_compression_policy():
+    with pytest.raises(ValueError):
+        WebSocketCompression(threshold=-1)
+
+    with pytest.raises(ValueError):
+        WebSocketCompression(level=10)
+
+    policy = WebSocketCompression(threshold=100)
+    compressor = policy.create_compressor()
+    assert policy.compress(compressor, b"x" * 99) is None
+    assert policy.compress(compressor, b"x" * 1000) is not None
+    metrics = policy.metrics()
+    assert metrics["messages"] == 2
+    assert metrics["compressed"] == 1
+    assert metrics["bytes_in"] == 1099
+    assert metrics["bytes_saved"] == metrics["bytes_in"] - metrics["bytes_out"] > 0
+
+    offered = {"headers": [(b"sec-websocket-extensions", b"permessage-deflate; x=1")]}
+    assert not policy.accepts(offered)
+    assert WebSocketCompression(respect_permessage_deflate=False).accepts(offered)
+    assert policy.accepts({"headers": []})
+
+
+def create_app(compression):
+    rpc = JsonRpcRouter(websocket_compression=compression)
+
+    @rpc.post()
+    class Snapshot(BaseModel):
+        size: int
+
+        def __call__(self):
+            return ["item"] * self.size
+
+    @rpc.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        rpc_websocket = rpc.get_websocket(websocket)
+        await rpc_websocket.accept()
+        await rpc_websocket.serve(max_in_flight=1)
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+    return app
+
+
+def test_websocket_compression():
+    compression = WebSocketCompression(threshold=256)
+    client = TestClient(create_app(compression))
+    with client.websocket_connect(
+        "/jsonrpc/ws", subprotocols=[WebSocketCompression.SUBPROTOCOL]
+    ) as websocket:
+        assert websocket.accepted_subprotocol == WebSocketCompression.SUBPROTOCOL
+        decompressor = DeflateDecompressor()
+
+        websocket.send_json(REQ("snapshot", {"size": 1}, id=1))
+        assert websocket.receive_json() == OK(id=1, result=["item"])
+
+        for id in [2, 3]:
+            websocket.send_json(REQ("snapshot", {"size": 1000}, id=id))
+            data = decompressor.decompress(websocket.receive_bytes())
+            assert json.loads(data) == OK(id=id, result=["item"] * 1000)
+
+    metrics = compression.metrics()
+    assert metrics["messages"] == 3
+    assert metrics["compressed"] == 2
+    assert metrics["bytes_saved"] > 0
+
+
+def test_websocket_compression_not_negotiated():
+    client = TestClient(create_app(None))
+    with client.websocket_connect(
+        "/jsonrpc/ws", subprotocols=[WebSocketCompression.SUBPROTOCOL]
+    ) as websocket:
+        assert websocket.accepted_subprotocol is None
+        websocket.send_json(REQ("snapshot", {"size": 1000}, id=1))
+        assert websocket.receive_json() == OK(id=1, result=["item"] * 1000)
+
+    compression = WebSocketCompression()
+    client = TestClient(create_app(compression))
+    with client.websocket_connect(
+        "/jsonrpc/ws",
+        subprotocols=[WebSocketCompression.SUBPROTOCOL],
+        headers={"sec-websocket-extensions": "permessage-deflate"},
+    ) as websocket:
+        assert websocket.accepted_subprotocol is None
+        websocket.send_json(REQ("snapshot", {"size": 1000}, id=1))
+        assert websocket.receive_json() == OK(id=1, result=["item"] * 1000)
+    assert compression.metrics()["messages"] == 0
+
+
+def test_http_negotiate():
+    compression = HttpCompression(encodings=["gzip"])
+    assert compression.encodings == ("gzip",)
+
+    def negotiate(accept):
+        return compression.negotiate({"headers": [(b"accept-encoding", accept)]})
+
+    assert negotiate(b"gzip, deflate") == "gzip"
+    assert negotiate(b"GZIP;q=0.5") == "gzip"
+    assert negotiate(b"*") == "gzip"
+    assert negotiate(b"gzip;q=0") is None
+    assert negotiate(b"deflate") is None
+    assert compression.negotiate({"headers": []}) is None
+
+    with pytest.raises(ValueError):
+        HttpCompression(encodings=["lzma"])
+
+
+@pytest.mark.parametrize(
+    "encoding, module, decompress",
+    [
+        ("gzip", "gzip", "decompress"),
+        ("br", "brotli", "decompress"),
+        ("zstd", "zstandard", "decompress"),
+    ],
+)
+def test_http_encodings(encoding, module, decompress):
+    module = pytest.importorskip(module)
+    compression = HttpCompression()
+    assert encoding in compression.encodings
+    accept = f"gzip;q=0.5, {encoding}".encode()
+    assert compression.negotiate({"headers": [(b"accept-encoding", accept)]}) == (
+        encoding
+    )
+    data = b"x" * 10000
+    if encoding == "zstd":
+        decompress = module.ZstdDecompressor().decompress
+    else:
+        decompress = getattr(module, decompress)
+    assert decompress(compression.compress(data, encoding)) == data
+
+
+def create_http_app(compression):
+    rpc = JsonRpcRouter(http_compression=compression)
+
+    @rpc.post()
+    class Snapshot(BaseModel):
+        size: int
+
+        def __call__(self):
+            return ["item"] * self.size
+
+    @rpc.post(compress=False)
+    class Raw(BaseModel):
+        size: int
+
+        def __call__(self):
+            return ["item"] * self.size
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+    return app
+
+
+def test_http_compression():
+    compression = HttpCompression(threshold=256, encodings=["gzip"])
+    client = TestClient(create_http_app(compression))
+    headers = {"accept-encoding": "gzip"}
+
+    def post(path, payload):
+        return client.post(path, json=payload, headers=headers)
+
+    res = post("/jsonrpc/", REQ("snapshot", {"size": 1000}, id=1))
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.headers["vary"] == "Accept-Encoding"
+    assert res.json() == OK(id=1, result=["item"] * 1000)
+
+    # 小さな応答やエラーは圧縮しない
+    res = post("/jsonrpc/", REQ("snapshot", {"size": 1}, id=2))
+    assert "content-encoding" not in res.headers
+    res = post("/jsonrpc/", REQ("xxx", id=3))
+    assert "content-encoding" not in res.headers
+
+    res = post("/jsonrpc/", REQ("raw", {"size": 1000}, id=4))
+    assert "content-encoding" not in res.headers
+    assert res.json() == OK(id=4, result=["item"] * 1000)
+
+    res = post("/jsonrpc/", [REQ("raw", {"size": 1000}, id=5)])
+    assert res.headers["content-encoding"] == "gzip"
+
+    res = post("/jsonrpc/snapshot", {"size": 1000})
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.json() == ["item"] * 1000
+    res = post("/jsonrpc/raw", {"size": 1000})
+    assert "content-encoding" not in res.headers
+
+    res = client.post(
+        "/jsonrpc/",
+        json=REQ("snapshot", {"size": 1000}, id=6),
+        headers={"accept-encoding": "identity"},
+    )
+    assert "content-encoding" not in res.headers
+
+    metrics = compression.metrics()
+    assert metrics["compressed"] == 3
+    assert metrics["bytes_saved"] > 0
+
+
+def test_http_compression_in_thread(monkeypatch):
+    import threading
+
+    compression = HttpCompression(threshold=0, encodings=["gzip"], thread_threshold=0)
+    compress = compression.compress
+    threads = []
+
+    def spy(data, encoding):
+        threads.append(threading.get_ident())
+        return compress(data, encoding)
+
+    monkeypatch.setattr(compression, "compress", spy)
+    client = TestClient(create_http_app(compression))
+    res = client.post(
+        "/jsonrpc/",
+        json=REQ("snapshot", {"size": 10}, id=1),
+        headers={"accept-encoding": "gzip"},
+    )
+    assert res.json() == OK(id=1, result=["item"] * 10)
+    assert threads and threads[0] != threading.get_ident()
@@ -0,0 +1,90 @@
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.errorlog import ErrorLog
+from tests import ERR, REQ
+
+
+def raise_error(message="fail"):
+    try:
+        raise ValueError(message)
+    except ValueError as e:
+        return e
+
+
+def test_error_log(monkeypatch, caplog):
+    from fastjsonrpc import errorlog
+
+    now = 0.0
+    monkeypatch.setattr(errorlog.time, "monotonic", lambda: now)
+    error_log = ErrorLog(max_per_second=2)
+
+    with caplog.at_level(logging.ERROR, logger="fastjsonrpc.router"):
+        assert [error_log.log(raise_error()) for _ in range(4)] == [
+            True,
+            True,
+            False,
+            False,
+        ]
+        now = 0.5
+        assert error_log.log(raise_error("next"))
+
+    assert error_log.logged == 3
+    assert error_log.suppressed == 0
+    record = caplog.records[-1]
+    assert record.message.startswith("ValueError: next (")
+    assert "in raise_error)" in record.message
+    assert record.message.endswith("[2 errors suppressed]")
+    assert record.exc_info[1].args == ("next",)
+
+
+def test_error_log_sampling(monkeypatch):
+    from fastjsonrpc import errorlog
+
+    with pytest.raises(ValueError):
+        ErrorLog(sample_rate=2)
+
+    values = iter([0.5, 0.1])
+    monkeypatch.setattr(errorlog.random, "random", lambda: next(values))
+    error_log = ErrorLog(sample_rate=0.2, max_per_second=None)
+    assert not error_log.log(raise_error())
+    assert error_log.log(raise_error())
+
+
+def test_error_log_disabled(caplog):
+    logger = logging.getLogger("test_error_log_disabled")
+    logger.setLevel(logging.CRITICAL)
+    error_log = ErrorLog(logger=logger)
+
+    assert not error_log.log(raise_error())
+    assert error_log.suppressed == 0
+    assert caplog.records == []
+
+
+def test_router_error_log(caplog):
+    logger = logging.getLogger("test_router_error_log")
+    api = JsonRpcRouter(error_log=ErrorLog(logger=logger, max_per_second=1))
+
+    @api.post()
+    class Fail(BaseModel):
+        def __call__(self):
+            raise ValueError("fail")
+
+    app = FastAPI()
+    app.include_router(api)
+    client = TestClient(app)
+
+    with caplog.at_level(logging.ERROR, logger="test_router_error_log"):
+        for _ in range(3):
+            response = client.post("/", json=REQ("fail", id=1))
+            assert response.json() == ERR(
+                id=1, code=-32603, message="Internal Server Error.", data=None
+            )
+
+    assert len(caplog.records) == 1
+    assert api.error_log.suppressed == 2
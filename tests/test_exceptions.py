@@ -0,0 +1,89 @@
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from fastjsonrpc.exceptions import (
+    InternalServerError,
+    InvalidParamsError,
+    MethodNotFoundError,
+    RpcError,
+)
+
+
+@pytest.mark.parametrize(
+    "err",
+    [
+        MethodNotFoundError(),
+        InvalidParamsError([{"loc": ["body"], "msg": "error"}]),
+        InternalServerError("secret"),
+        RpcError({"reason": "x"}),
+    ],
+)
+def test_to_dict(err):
+    assert err.to_dict(id=1) == err.to_pydantic(id=1).dict()
+    assert err.to_dict() == err.to_pydantic().dict()
+
+
+@pytest.mark.parametrize(
+    "err",
+    [
+        MethodNotFoundError(),
+        InvalidParamsError([{"loc": ["body"], "msg": "エラー"}]),
+        InternalServerError("secret"),
+        RpcError({"reason": "x"}),
+    ],
+)
+def test_render(err):
+    assert json.loads(err.render()) == err.to_dict()
+    assert json.loads(err.render(id=1, dumps=lambda x: json.dumps(x).encode())) == (
+        err.to_dict(id=1)
+    )
+
+
+def test_render_user_error():
+    class TooManyRequests(RpcError):
+        code = -32029
+        message = 'Too "many" requests.'
+
+    class Dynamic(RpcError):
+        def __init__(self, data=None):
+            super().__init__(data)
+            self.message = f"dynamic {data}"
+
+    class Data(BaseModel):
+        value: int
+
+    assert TooManyRequests._prefix is not None
+    assert TooManyRequests().render(id=3) == (
+        b'{"jsonrpc":"2.0","error":{"code":-32029,"message":"Too \\"many\\" requests.",'
+        b'"data":null},"id":3}'
+    )
+    assert json.loads(Dynamic(1).render())["error"]["message"] == "dynamic 1"
+    assert json.loads(RpcError(Data(value=1)).render())["error"]["data"] == {"value": 1}
+
+
+def test_render_user_error_model_data():
+    class Item(BaseModel):
+        name: str
+        tags: List[str] = []
+
+    class OutOfStock(RpcError):
+        code = -32010
+        message = "Out of stock."
+
+    err = OutOfStock(Item(name="あ", tags=["x"]))
+    assert OutOfStock._prefix is not None
+    assert (
+        err.render(id=2)
+        == (
+            '{"jsonrpc":"2.0","error":{"code":-32010,"message":"Out of stock.",'
+            '"data":{"name":"あ","tags":["x"]}},"id":2}'
+        ).encode()
+    )
+    assert json.loads(err.render(id=2)) == err.to_dict(id=2)
+    assert RpcError.from_dict(json.loads(err.render())["error"]).data == {
+        "name": "あ",
+        "tags": ["x"],
+    }
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.executor import ProcessPool
+from tests import ERR, IGNORE, OK, REQ, as_async
+
+
+# プロセスに渡すため、モジュールレベルで定義する
+class GetPid(BaseModel):
+    def __call__(self):
+        return os.getpid()
+
+
+class Square(BaseModel):
+    value: int
+
+    def __call__(self):
+        if self.value < 0:
+            raise ValueError("negative")
+        return self.value**2
+
+
+def test_process_method():
+    api = JsonRpcRouter(process_workers=2)
+    api.post(executor="process")(GetPid)
+    api.post(executor="process")(Square)
+
+    app = FastAPI()
+    app.include_router(api)
+
+    with TestClient(app) as client:
+        assert api.processes.is_started
+
+        response = client.post("/", json=REQ("get_pid", id=1))
+        assert response.json() == OK(id=1, result=IGNORE)
+        assert response.json()["result"] != os.getpid()
+
+        response = client.post("/", json=REQ("square", {"value": 3}, id=1))
+        assert response.json() == OK(id=1, result=9)
+
+        response = client.post("/", json=REQ("square", {"value": "x"}, id=1))
+        assert response.json()["error"]["code"] == -32602
+
+        response = client.post("/", json=REQ("square", {"value": -1}, id=1))
+        assert response.json() == ERR(id=1, code=-32603, message=IGNORE, data=None)
+
+    assert not api.processes.is_started
+
+
+def test_process_method_validation():
+    api = JsonRpcRouter()
+
+    with pytest.raises(ValueError, match="Unknown executor"):
+        api.post(executor="xxx")
+
+    class Async(BaseModel):
+        async def __call__(self):
+            ...
+
+    class Depends(BaseModel):
+        def __call__(self, request: Request):
+            ...
+
+    class Generator(BaseModel):
+        def __call__(self):
+            yield 1
+
+    def func():
+        ...
+
+    for target, message in [
+        (Async, "sync functions"),
+        (Depends, "dependencies"),
+        (Generator, "yield"),
+        (func, "BaseModel"),
+    ]:
+        with pytest.raises(TypeError, match=message):
+            api.post(executor="process")(target)
+
+    assert api.on_startup == []
+
+
+@as_async
+async def test_process_pool():
+    with pytest.raises(ValueError, match="must be greater than 0"):
+        ProcessPool(max_workers=0)
+
+    pool = ProcessPool(max_workers=2, warmup=False)
+    try:
+        assert await pool.run(abs, -1) == 1
+        assert pool.is_started
+        assert 1 <= await pool.run_warmup() <= 2
+    finally:
+        pool.shutdown()
+
+
+@as_async
+async def test_process_pool_aclose():
+    pool = ProcessPool(max_workers=1, warmup=False)
+    await pool.start()
+    call = asyncio.create_task(pool.run(time.sleep, 0.3))
+    await asyncio.sleep(0.05)
+
+    # 実行中の呼び出しを待つ間もイベントループは止まらない
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    await pool.aclose()
+    ticker.cancel()
+
+    assert ticks >= 5
+    assert not pool.is_started
+    await call
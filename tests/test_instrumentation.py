@@ -0,0 +1,139 @@
+import json
+
+from fastapi import Depends, FastAPI
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.instrumentation import (
+    DEPENDENCIES,
+    HANDLER,
+    PARSE,
+    SERIALIZE,
+    VALIDATE,
+    CallbackInstrumentation,
+    Histogram,
+    HistogramInstrumentation,
+)
+from fastjsonrpc.localclient import LocalClient
+from fastjsonrpc.websocket import JsonRpcWebSocket
+from tests import NOTIFY, REQ, as_async
+
+
+def get_value():
+    return 1
+
+
+def create_app(instrumentation):
+    api = JsonRpcRouter(instrumentation=instrumentation)
+
+    @api.post()
+    class Echo(BaseModel):
+        msg: str
+
+        def __call__(self):
+            return self.msg
+
+    @api.post()
+    class Depends_(BaseModel):
+        msg: str
+
+        def __call__(self, value: int = Depends(get_value)):
+            return value
+
+    @api.post()
+    class Fail(BaseModel):
+        def __call__(self):
+            raise Exception("fail")
+
+    app = FastAPI()
+    app.include_router(api)
+    return app, api
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2, 3))
+    for value in [0.5, 1.5, 1.5, 2.5, 10]:
+        histogram.observe(value)
+
+    result = histogram.to_dict()
+    assert result["count"] == 5
+    assert result["sum"] == 16
+    assert result["p50"] == 2
+    assert result["p99"] == float("inf")
+    assert result["buckets"] == {1: 1, 2: 2, 3: 1, float("inf"): 1}
+    assert Histogram().quantile(0.5) == 0.0
+
+
+@as_async
+async def test_http_instrumentation():
+    instrumentation = HistogramInstrumentation()
+    app, api = create_app(instrumentation)
+    client = LocalClient.from_asgi(app)
+
+    for req in [
+        REQ("echo", {"msg": "a"}, id=1),
+        REQ("depends_", {"msg": "a"}, id=1),
+        REQ("echo", {}, id=1),
+        REQ("fail", id=1),
+        REQ("xxx", id=1),
+    ]:
+        await client.call(method="POST", url="/", json=req)
+    await client.call(method="POST", url="/", data=b"{")
+
+    stats = instrumentation.snapshot()
+    assert stats["echo"]["calls"] == 1
+    assert set(stats["echo"]["stages"]) == {PARSE, VALIDATE, HANDLER, SERIALIZE}
+    assert stats["echo"]["stages"][PARSE]["count"] == 2
+    assert stats["echo"]["errors"] == {-32602: 1}
+
+    assert stats["depends_"]["calls"] == 1
+    assert DEPENDENCIES in stats["depends_"]["stages"]
+    assert VALIDATE not in stats["depends_"]["stages"]
+
+    assert stats["fail"]["calls"] == 1
+    assert SERIALIZE not in stats["fail"]["stages"]
+    assert stats["fail"]["errors"] == {-32603: 1}
+
+    # メソッドに紐づかないエラーはNoneに集計される
+    assert stats[None]["errors"] == {-32601: 1, -32700: 1}
+    assert stats[None]["calls"] == 0
+
+
+@as_async
+async def test_batch_and_notification_instrumentation():
+    timings = []
+    errors = []
+    instrumentation = CallbackInstrumentation(
+        on_timing=lambda method, stage, seconds: timings.append((method, stage)),
+        on_error=lambda method, code: errors.append((method, code)),
+    )
+    app, api = create_app(instrumentation)
+    client = LocalClient.from_asgi(app)
+
+    batch = [REQ("echo", {"msg": "a"}, id=1), REQ("fail", id=2)]
+    await client.call(method="POST", url="/", json=batch)
+    await client.call(method="POST", url="/", json=NOTIFY("fail"))
+    await api.notifications.join()
+
+    assert (None, PARSE) in timings
+    assert ("echo", HANDLER) in timings
+    assert ("echo", SERIALIZE) in timings
+    assert errors == [("fail", -32603), ("fail", -32603)]
+
+
+@as_async
+async def test_websocket_instrumentation():
+    instrumentation = HistogramInstrumentation()
+    app, api = create_app(instrumentation)
+    scope = {"type": "websocket", "app": app, "router": app.router}
+    websocket = JsonRpcWebSocket(scope, None, None, api)
+
+    await websocket.request_rpc_text(json.dumps(REQ("echo", {"msg": "a"}, id=1)))
+    await websocket.request_rpc_text("{")
+
+    stats = instrumentation.snapshot()
+    assert set(stats["echo"]["stages"]) == {PARSE, VALIDATE, HANDLER, SERIALIZE}
+    assert stats[None]["errors"] == {-32700: 1}
+
+    instrumentation.reset()
+    assert instrumentation.snapshot() == {}
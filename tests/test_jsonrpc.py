@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
@@ -118,23 +120,14 @@ def test_error_code():
 
 
 def test_parse_error(client: TestClient):
-    response = client.post("/", data="")
-    assert response.status_code == 200
-    assert response.json() == ERR(
-        id=None,
-        code=ParseError.code,
-        message="Parse error.",
-        data="Expecting value: line 1 column 1 (char 0)",
-    )
-
-    response = client.post("/", data="a")
-    assert response.status_code == 200
-    assert response.json() == ERR(
-        id=None,
-        code=ParseError.code,
-        message="Parse error.",
-        data="Expecting value: line 1 column 1 (char 0)",
-    )
+    # メッセージはコーデックにより異なるため、位置のみを検証する
+    for data in ["", "a"]:
+        response = client.post("/", data=data)
+        assert response.status_code == 200
+        assert response.json() == ERR(
+            id=None, code=ParseError.code, message="Parse error.", data=IGNORE
+        )
+        assert response.json()["error"]["data"].endswith("line 1 column 1 (char 0)")
 
 
 @pytest.mark.parametrize(
@@ -150,9 +143,9 @@ def test_parse_error(client: TestClient):
             ),
         ),
         (
-            NOTIFY("xxx"),
+            REQ("xxx", id=1),
             ERR(
-                id=None,
+                id=1,
                 code=MethodNotFoundError.code,
                 message="Method not found.",
                 data=None,
@@ -168,9 +161,9 @@ def test_parse_error(client: TestClient):
             ),
         ),
         (
-            NOTIFY("/"),
+            REQ("/", id=1),
             ERR(
-                id=None,
+                id=1,
                 code=MethodNotFoundError.code,
                 message=MethodNotFoundError.message,
                 data=None,
@@ -182,9 +175,9 @@ def test_parse_error(client: TestClient):
         #     id=None, code=MethodNotFoundError.code, message="Method not found.", data=IGNORE
         # )
         (
-            NOTIFY("echo"),
+            REQ("echo", id=1),
             ERR(
-                id=None,
+                id=1,
                 code=InvalidParamsError.code,
                 message=InvalidParamsError.message,
                 data=Match("msg.*field.*required", to_str=True),
@@ -204,9 +197,9 @@ def test_invalid_request(client: TestClient, req, res):
     [
         (REQ("echo", {"msg": "hello!!!"}, id=1), OK(id=1, result="hello!!!"), None),
         (
-            NOTIFY("error", {"msg": "_"}),
+            REQ("error", {"msg": "_"}, id=1),
             ERR(
-                id=None,
+                id=1,
                 code=InternalServerError.code,
                 message=InternalServerError.message,
                 data=None,
@@ -214,9 +207,9 @@ def test_invalid_request(client: TestClient, req, res):
             Exception("_"),
         ),
         (
-            NOTIFY("rpc_error", {"msg": "_"}),
+            REQ("rpc_error", {"msg": "_"}, id=1),
             ERR(
-                id=None,
+                id=1,
                 code=RpcError.code,
                 message=RpcError.message,
                 data="_",
@@ -258,6 +251,118 @@ def test_valid_request(sample_app, req, res, exc):
         raise Exception()  # pragma: no cover
 
 
+########################################
+# batch test
+########################################
+def test_batch_request(client: TestClient):
+    response = client.post(
+        "/",
+        json=[
+            REQ("echo", {"msg": "hello 1"}, id=1),
+            REQ("rpc_error", {"msg": "err!"}, id=2),
+            REQ("xxx", {}, id=3),
+            REQ("echo", {}, id=4),
+            REQ("echo", {"msg": "hello 5"}, id=5),
+        ],
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        OK(id=1, result="hello 1"),
+        ERR(id=2, code=RpcError.code, message=RpcError.message, data="err!"),
+        ERR(
+            id=3,
+            code=MethodNotFoundError.code,
+            message=MethodNotFoundError.message,
+            data=None,
+        ),
+        ERR(
+            id=4,
+            code=InvalidParamsError.code,
+            message=InvalidParamsError.message,
+            data=Match("msg.*field.*required", to_str=True),
+        ),
+        OK(id=5, result="hello 5"),
+    ]
+
+
+def test_batch_invalid_members():
+    from fastjsonrpc.websocket import JsonRpcWebSocket
+    from tests import _sample_app_router
+
+    app, router = _sample_app_router()
+    client = TestClient(app)
+
+    # 不正なメンバーにはそれぞれエラーを返し、正しいメンバーは実行する
+    batch = [
+        REQ("echo", {"msg": "hello 1"}, id=1),
+        1,
+        {"foo": "boo"},
+        {"jsonrpc": "1.0", "method": "echo", "params": {"msg": "x"}, "id": 3},
+        NOTIFY("echo", {"msg": "n"}),
+        REQ("echo", {"msg": "hello 5"}, id=5),
+    ]
+    invalid = ERR(
+        id=None,
+        code=InvalidRequestError.code,
+        message=InvalidRequestError.message,
+        data=IGNORE,
+    )
+    expected = [
+        OK(id=1, result="hello 1"),
+        invalid,
+        invalid,
+        dict(invalid, id=3),
+        OK(id=5, result="hello 5"),
+    ]
+
+    response = client.post("/", json=batch)
+    assert response.status_code == 200
+    assert response.json() == expected
+
+    scope = {"type": "websocket", "app": app, "router": app.router}
+    websocket = JsonRpcWebSocket(scope, None, None, router)
+    assert asyncio.run(websocket.post(batch)) == expected
+
+
+def test_batch_empty(client: TestClient):
+    response = client.post("/", json=[])
+    assert response.status_code == 200
+    assert response.json() == ERR(
+        id=None,
+        code=InvalidRequestError.code,
+        message=InvalidRequestError.message,
+        data=IGNORE,
+    )
+
+
+def test_batch_concurrency():
+    import asyncio
+
+    with pytest.raises(ValueError, match="must be greater than 0"):
+        JsonRpcRouter(batch_concurrency=0)
+
+    api = JsonRpcRouter(batch_concurrency=2)
+    running = {"current": 0, "max": 0}
+
+    @api.post()
+    class Sleep(BaseModel):
+        async def __call__(self):
+            running["current"] += 1
+            running["max"] = max(running["max"], running["current"])
+            await asyncio.sleep(0.01)
+            running["current"] -= 1
+            return running["max"]
+
+    app = FastAPI()
+    app.include_router(api)
+    client = TestClient(app)
+
+    response = client.post("/", json=[REQ("sleep", id=i) for i in range(6)])
+    assert response.status_code == 200
+    assert [x["id"] for x in response.json()] == list(range(6))
+    assert running["max"] == 2
+
+
 ########################################
 # complex test
 ########################################
@@ -295,6 +400,241 @@ def test_include_router_prefix():
     assert response.json() == OK(id=1, result="hello 2")
 
 
+def test_dispatch_without_rerouting():
+    from fastapi import Depends
+
+    def get_suffix():
+        return ""
+
+    api = JsonRpcRouter()
+
+    @api.post()
+    class Echo(BaseModel):
+        msg: str
+
+        def __call__(self, suffix: str = Depends(get_suffix)):
+            return self.msg + suffix
+
+    app = FastAPI()
+
+    # the method route must be called even if another route shadows its path
+    @app.post("/echo")
+    def shadow():
+        return "shadowed"  # pragma: no cover
+
+    app.include_router(api)
+    app.dependency_overrides[get_suffix] = lambda: "!!!"
+    client = TestClient(app)
+
+    assert api._handlers["/echo"].path == "/echo"
+    response = client.post("/", json=REQ("echo", {"msg": "hello"}, id=1))
+    assert response.status_code == 200
+    assert response.json() == OK(id=1, result="hello!!!")
+
+
+def test_router_included_twice():
+    from fastapi import Depends, WebSocket
+
+    called = []
+    api = JsonRpcRouter()
+
+    @api.post()
+    class Echo(BaseModel):
+        msg: str
+
+        def __call__(self):
+            return self.msg
+
+    @api.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        await api.get_websocket(websocket).serve()
+
+    def tag(value):
+        return Depends(lambda: called.append(value))
+
+    app = FastAPI()
+    app.include_router(api, prefix="/a", dependencies=[tag("a")])
+    app.include_router(api, prefix="/b", dependencies=[tag("b")])
+    client = TestClient(app)
+
+    # 各prefixの依存性で呼び出される
+    for prefix in ["a", "b"]:
+        called.clear()
+        response = client.post(f"/{prefix}/", json=REQ("echo", {"msg": "x"}, id=1))
+        assert response.json() == OK(id=1, result="x")
+        assert called == [prefix]
+
+        called.clear()
+        with client.websocket_connect(f"/{prefix}/ws") as websocket:
+            websocket.send_json(REQ("echo", {"msg": "y"}, id=1))
+            assert websocket.receive_json() == OK(id=1, result="y")
+        assert called == [prefix]
+
+    # ローカルクライアントは最初のincludeを使う
+    called.clear()
+    assert asyncio.run(api.get_client(app).call("echo", msg="z")) == "z"
+    assert called == ["a"]
+
+
+def test_response_model():
+    class User(BaseModel):
+        name: str
+
+    api = JsonRpcRouter()
+
+    @api.post(response_model=User)
+    class GetUser(BaseModel):
+        def __call__(self):
+            return {"name": "bob", "password": "secret"}
+
+    app = FastAPI()
+    app.include_router(api)
+    client = TestClient(app)
+
+    response = client.post("/", json=REQ("get_user", id=1))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == OK(id=1, result={"name": "bob"})
+
+    response = client.post("/get_user", json={})
+    assert response.status_code == 200
+    assert response.json() == {"name": "bob"}
+
+
+def test_skip_solve_dependencies(monkeypatch):
+    from fastapi import Depends, Request
+
+    from fastjsonrpc import handler
+
+    api = JsonRpcRouter()
+
+    @api.post()
+    class Echo(BaseModel):
+        msg: str = "hello"
+
+        def __call__(self):
+            return self.msg
+
+    @api.post()
+    class EchoPath(BaseModel):
+        def __call__(self, request: Request):
+            return request.url.path
+
+    @api.post()
+    class EchoDepends(BaseModel):
+        def __call__(self, value: str = Depends(lambda: "depends")):
+            return value
+
+    assert handler.is_dependency_free(api._handlers["/echo"].dependant)
+    assert not handler.is_dependency_free(api._handlers["/echo_path"].dependant)
+    assert not handler.is_dependency_free(api._handlers["/echo_depends"].dependant)
+
+    app = FastAPI()
+    app.include_router(api)
+    client = TestClient(app)
+
+    solved = []
+    solve_dependencies = handler.solve_dependencies
+
+    async def spy(**kwargs):
+        solved.append(kwargs["dependant"].call.__name__)
+        return await solve_dependencies(**kwargs)
+
+    monkeypatch.setattr(handler, "solve_dependencies", spy)
+
+    response = client.post("/", json=REQ("echo", {"msg": "hi"}, id=1))
+    assert response.json() == OK(id=1, result="hi")
+    response = client.post("/", json=REQ("echo", {"msg": 1}, id=1))
+    assert response.json() == OK(id=1, result="1")
+    response = client.post("/", json=REQ("echo", {"msg": []}, id=1))
+    assert response.json() == ERR(
+        id=1,
+        code=InvalidParamsError.code,
+        message=InvalidParamsError.message,
+        data=[{"loc": ["body", "msg"], "msg": "str type expected", "type": IGNORE}],
+    )
+    response = client.post("/echo", json=None)
+    assert response.status_code == 422
+    assert solved == []
+
+    response = client.post("/", json=REQ("echo_path", id=1))
+    assert response.json() == OK(id=1, result="/echo_path")
+    response = client.post("/", json=REQ("echo_depends", id=1))
+    assert response.json() == OK(id=1, result="depends")
+    assert solved == ["EchoPath", "EchoDepends"]
+
+
+def test_read_body():
+    import asyncio
+
+    from starlette.requests import ClientDisconnect
+
+    from fastjsonrpc.handler import read_body
+
+    def create_receive(*chunks, disconnect=False):
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": True}
+            for chunk in chunks
+        ]
+        if disconnect:
+            messages.append({"type": "http.disconnect"})
+        else:
+            messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+        async def receive():
+            return messages.pop(0)
+
+        return receive
+
+    def read(receive, content_length=None):
+        headers = {} if content_length is None else {"content-length": content_length}
+        return asyncio.run(read_body(receive, headers))
+
+    assert read(create_receive(b"ab", b"cd")) == b"abcd"
+    assert read(create_receive(b"ab", b"cd"), "4") == b"abcd"
+    assert read(create_receive(b"ab", b"cd"), "3") == b"abcd"
+    assert read(create_receive(b"ab", b"cd"), "10") == b"abcd"
+    assert read(create_receive(b"ab"), "xxx") == b"ab"
+    assert isinstance(read(create_receive(b"ab")), bytearray)
+    chunks = [b"x" * 100000] * 3
+    assert read(create_receive(*chunks), "300000") == b"".join(chunks)
+    assert read(create_receive(*chunks), "400000") == b"".join(chunks)
+
+    # 偽のcontent-lengthで大きな領域を確保しない
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        assert read(create_receive(b"ab", b"cd"), str(1 << 30)) == b"abcd"
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 1 << 20
+
+    with pytest.raises(ClientDisconnect):
+        read(create_receive(b"ab", disconnect=True))
+
+
+def test_validate_does_not_keep_body():
+    import asyncio
+    import json
+
+    from fastjsonrpc.handler import JsonRpcRequest
+
+    body = json.dumps(REQ("echo", {"msg": "a" * 1000}, id=1)).encode()
+    scope = {"type": "http", "headers": [(b"content-length", str(len(body)).encode())]}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    rpc = JsonRpcRequest(scope, receive, None)
+    asyncio.run(rpc.validate({"echo": None}))
+    assert rpc.params == {"msg": "a" * 1000}
+    assert scope["_jsonrpc_cache"]["_json"] is rpc.params
+    assert not hasattr(rpc, "_body")
+
+
 def test_specifiy_path():
     # TODO: @rpc.post("/echo")
     assert True
@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.errorlog import ErrorLog
+from fastjsonrpc.exceptions import InvalidParamsError
+from fastjsonrpc.localclient import LocalClient
+from fastjsonrpc.notification import NotificationPool
+from fastjsonrpc.websocket import JsonRpcWebSocket
+from tests import NOTIFY, OK, REQ, as_async
+
+
+def create_app(**kwargs):
+    api = JsonRpcRouter(**kwargs)
+    received = []
+
+    @api.post()
+    class Record(BaseModel):
+        msg: str
+
+        async def __call__(self):
+            await asyncio.sleep(0)
+            received.append(self.msg)
+            return self.msg
+
+    app = FastAPI()
+    app.include_router(api)
+    return app, api, received
+
+
+@as_async
+async def test_pool():
+    with pytest.raises(ValueError, match="must be greater than 0"):
+        NotificationPool(concurrency=0)
+
+    pool = NotificationPool(concurrency=1, max_queue_size=1)
+    done = []
+
+    async def ok():
+        done.append(1)
+
+    async def fail():
+        raise Exception("fail")
+
+    assert pool.submit(fail)
+    assert pool.submit(ok)
+    assert not pool.submit(ok)
+    assert pool.metrics() == {
+        "running": 1,
+        "queue_depth": 1,
+        "completed": 0,
+        "failed": 0,
+        "dropped": 1,
+    }
+
+    await pool.join()
+    assert done == [1]
+    assert pool.metrics() == {
+        "running": 0,
+        "queue_depth": 0,
+        "completed": 1,
+        "failed": 1,
+        "dropped": 1,
+    }
+
+
+@as_async
+async def test_http_notification():
+    app, api, received = create_app()
+    client = LocalClient.from_asgi(app)
+
+    for req in [NOTIFY("record", {"msg": "a"}), NOTIFY("xxx"), NOTIFY("record")]:
+        result = await client.call(method="POST", url="/", json=req)
+        assert result[0]["status"] == 204
+        assert result[1]["body"] == b""
+
+    await api.notifications.join()
+    assert received == ["a"]
+    assert api.notifications.completed == 1
+    assert api.notifications.failed == 1
+
+
+@as_async
+async def test_batch_notification():
+    app, api, received = create_app()
+    client = LocalClient.from_asgi(app)
+
+    batch = [NOTIFY("record", {"msg": "a"}), NOTIFY("xxx"), NOTIFY("record")]
+    result = await client.call(method="POST", url="/", json=batch)
+    assert result[0]["status"] == 204
+    assert result[1]["body"] == b""
+
+    batch = [NOTIFY("record", {"msg": "b"}), REQ("record", {"msg": "c"}, id=1)]
+    result = await client.call(method="POST", url="/", json=batch)
+    assert result[0]["status"] == 200
+    assert json.loads(result[1]["body"]) == [OK(id=1, result="c")]
+
+    await api.notifications.join()
+    assert sorted(received) == ["a", "b", "c"]
+
+
+@as_async
+async def test_notification_limit():
+    app, api, received = create_app(
+        notification_concurrency=1, notification_queue_size=0
+    )
+    client = LocalClient.from_asgi(app)
+
+    for msg in ["a", "b"]:
+        result = await client.call(
+            method="POST", url="/", json=NOTIFY("record", {"msg": msg})
+        )
+        assert result[0]["status"] == 204
+
+    await api.notifications.join()
+    assert received == ["a"]
+    assert api.notifications.dropped == 1
+
+
+@as_async
+async def test_websocket_notification():
+    app, api, received = create_app()
+    scope = {"type": "websocket", "app": app, "router": app.router}
+    websocket = JsonRpcWebSocket(scope, None, None, api)
+
+    assert await websocket.post(NOTIFY("record", {"msg": "a"})) is None
+    assert await websocket.request_rpc_text(json.dumps(NOTIFY("xxx"))) is None
+
+    await api.notifications.join()
+    assert received == ["a"]
+
+
+@as_async
+async def test_pool_logging(caplog):
+    error_log = ErrorLog()
+    pool = NotificationPool(concurrency=1, max_queue_size=0, error_log=error_log)
+
+    async def fail():
+        raise Exception("fail")
+
+    async def invalid():
+        raise InvalidParamsError()
+
+    assert pool.submit(fail)
+    for _ in range(3):
+        assert not pool.submit(fail)
+    await pool.join()
+    assert pool.submit(invalid)
+    await pool.join()
+
+    assert error_log.logged == 1
+    messages = [r.getMessage() for r in caplog.records]
+    assert messages.count("Notification queue is full. Dropping notifications.") == 1
+    assert "3 notifications were dropped while the queue was full." in messages
+    assert pool.failed == 2
+
+
+@as_async
+async def test_notification_error_logged_once():
+    api = JsonRpcRouter()
+
+    @api.post()
+    class Broken(BaseModel):
+        async def __call__(self):
+            raise RuntimeError("broken")
+
+    app = FastAPI()
+    app.include_router(api)
+    client = LocalClient.from_asgi(app)
+
+    result = await client.call(method="POST", url="/", json=NOTIFY("broken"))
+    assert result[0]["status"] == 204
+
+    await api.notifications.join()
+    assert api.notifications.failed == 1
+    assert api.error_log.logged == 1
@@ -0,0 +1,371 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from fastjsonrpc import JsonRpcRouter
+from fastjsonrpc.exceptions import InvalidRequestError, ParseError
+from fastjsonrpc.stream import BatchStreamParser
+from tests import ERR, IGNORE, NOTIFY, OK, REQ, as_async
+
+
+def split(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def parse(chunks):
+    parser = BatchStreamParser()
+    members = []
+    for chunk in chunks:
+        members += parser.feed(chunk)
+    return members + parser.close()
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_parser(size):
+    batch = [
+        {"msg": 'x,]}"[{\\', "nested": [1, {"a": [2]}]},
+        12345,
+        "日本語",
+        [],
+        {},
+        True,
+        None,
+    ]
+    data = json.dumps(batch, ensure_ascii=False).encode()
+    assert parse(split(data, size)) == batch
+    assert parse([b" [ ", b" ] "]) == []
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"{}",
+        b"[1,]",
+        b"[,1]",
+        b"[1 2]",
+        b"[1] 2",
+        b"[1",
+        b"[1.x]",
+        b"[tru]",
+        b'[{"a":}]',
+        b"",
+    ],
+)
+def test_parser_error(data):
+    with pytest.raises(ParseError):
+        parse(split(data, 1))
+
+
+def test_parser_split_everywhere():
+    data = b'[12.5, -3e+10, 0.25E-3, {"id": 1.5e2}, 7, "1.", 100]'
+    batch = json.loads(data)
+    for i in range(len(data) + 1):
+        assert parse([data[:i], data[i:]]) == batch
+
+
+def test_parser_large_member():
+    batch = [{"msg": "a" * 1000000}, {"msg": "b"}]
+    data = json.dumps(batch).encode()
+    assert parse(split(data, 1000)) == batch
+
+
+def create_app(**kwargs):
+    api = JsonRpcRouter(stream_batches=True, **kwargs)
+
+    @api.post()
+    class Echo(BaseModel):
+        msg: str
+
+        async def __call__(self):
+            await asyncio.sleep(0)
+            return self.msg
+
+    app = FastAPI()
+    app.include_router(api)
+    return app, api
+
+
+async def post(app, data: bytes, size=10):
+    chunks = split(data, size) or [b""]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+    sent = []
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+    }
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return sent[0]["status"], sent[1:], body
+
+
+@as_async
+async def test_stream_batch():
+    app, api = create_app()
+    batch = [REQ("echo", {"msg": str(i)}, id=i) for i in range(20)]
+    batch += [NOTIFY("echo", {"msg": "n"}), REQ("xxx", id=100), 1]
+
+    status, messages, body = await post(app, json.dumps(batch).encode())
+    assert status == 200
+    assert len(messages) == 23
+    assert messages[-1] == {
+        "type": "http.response.body",
+        "body": b"]",
+        "more_body": False,
+    }
+
+    result = sorted(
+        json.loads(body), key=lambda x: x["id"] if x["id"] is not None else -1
+    )
+    assert result == [
+        ERR(id=None, code=InvalidRequestError.code, message=IGNORE, data=IGNORE)
+    ] + [OK(id=i, result=str(i)) for i in range(20)] + [
+        ERR(id=100, code=-32601, message=IGNORE, data=IGNORE)
+    ]
+    await api.notifications.join()
+
+
+@as_async
+async def test_stream_batch_errors():
+    app, api = create_app()
+
+    status, _, body = await post(app, b"[]")
+    assert json.loads(body) == ERR(
+        id=None, code=InvalidRequestError.code, message=IGNORE, data=IGNORE
+    )
+
+    status, _, body = await post(app, b"[1,")
+    assert json.loads(body) == ERR(
+        id=None, code=ParseError.code, message=IGNORE, data="Unterminated batch."
+    )
+
+    # 応答済みの要素があれば、エラーを配列に加える
+    data = json.dumps([REQ("echo", {"msg": "a"}, id=1)]).encode()[:-1] + b",}"
+    status, _, body = await post(app, data)
+    assert json.loads(body) == [
+        OK(id=1, result="a"),
+        ERR(id=None, code=ParseError.code, message=IGNORE, data=IGNORE),
+    ]
+
+    status, _, body = await post(
+        app, json.dumps([NOTIFY("echo", {"msg": "a"})]).encode()
+    )
+    assert status == 204
+    await api.notifications.join()
+
+
+@as_async
+async def test_stream_single_request():
+    app, api = create_app()
+    data = json.dumps(REQ("echo", {"msg": "a"}, id=1)).encode()
+    status, messages, body = await post(app, b"  " + data, size=1)
+    assert status == 200
+    assert json.loads(body) == OK(id=1, result="a")
+
+
+@as_async
+async def test_stream_batch_concurrency():
+    app, api = create_app(batch_concurrency=2)
+    running = 0
+    peak = 0
+
+    @api.post()
+    class Sleep(BaseModel):
+        async def __call__(self):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return None
+
+    app = FastAPI()
+    app.include_router(api)
+
+    batch = [REQ("sleep", id=i) for i in range(10)]
+    status, _, body = await post(app, json.dumps(batch).encode())
+    assert len(json.loads(body)) == 10
+    assert peak == 2
+
+
+def create_generator_app():
+    from fastapi import WebSocket
+
+    api = JsonRpcRouter()
+
+    class Item(BaseModel):
+        value: int
+
+    @api.post(response_model=Item)
+    class Count(BaseModel):
+        n: int
+        fail: bool = False
+
+        async def __call__(self):
+            for i in range(self.n):
+                if self.fail and i == 2:
+                    raise Exception("fail")
+                yield {"value": i, "secret": "x"}
+
+    @api.post()
+    class CountSync(BaseModel):
+        n: int
+
+        def __call__(self):
+            yield from range(self.n)
+
+    @api.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        await api.get_websocket(websocket).serve()
+
+    app = FastAPI()
+    app.include_router(api)
+    return app, api
+
+
+def test_http_generator_result():
+    from fastapi.testclient import TestClient
+
+    app, api = create_generator_app()
+    client = TestClient(app)
+
+    response = client.post("/", json=REQ("count", {"n": 3}, id=1))
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == OK(
+        id=1, result=[{"value": 0}, {"value": 1}, {"value": 2}]
+    )
+
+    response = client.post("/", json=REQ("count_sync", {"n": 3}, id=1))
+    assert response.json() == OK(id=1, result=[0, 1, 2])
+
+    response = client.post("/", json=REQ("count", {"n": 0}, id=1))
+    assert response.json() == OK(id=1, result=[])
+
+    # 最初の要素より前のエラーは通常のエラー応答になる
+    response = client.post("/", json=REQ("count_sync", {"n": "x"}, id=1))
+    assert response.json()["error"]["code"] == -32602
+
+    # 途中で失敗した場合は、途中までの結果を返さずエラー応答のみを返す
+    response = client.post("/", json=REQ("count", {"n": 5, "fail": True}, id=1))
+    assert response.json() == ERR(
+        id=1, code=-32603, message="Internal Server Error.", data=None
+    )
+    assert api.error_log.logged == 1
+
+    # バッチでは結果をまとめて返す
+    response = client.post("/", json=[REQ("count_sync", {"n": 2}, id=1)])
+    assert response.json() == [OK(id=1, result=[0, 1])]
+
+
+def test_direct_generator_result():
+    from fastapi.testclient import TestClient
+
+    app, api = create_generator_app()
+    client = TestClient(app, raise_server_exceptions=False)
+
+    response = client.post("/count", json={"n": 3})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == [{"value": 0}, {"value": 1}, {"value": 2}]
+
+    response = client.post("/count_sync", json={"n": 3})
+    assert response.json() == [0, 1, 2]
+
+    response = client.post("/count", json={"n": 0})
+    assert response.json() == []
+
+    # 最初の要素より前のエラーは通常のエラー応答になる
+    response = client.post("/count_sync", json={"n": "x"})
+    assert response.status_code == 422
+
+
+@as_async
+async def test_direct_generator_failure():
+    app, api = create_generator_app()
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/count",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+    }
+    body = json.dumps({"n": 5, "fail": True}).encode()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    # 配列を閉じた後、応答を完了させずに例外でサーバーに接続を切断させる
+    with pytest.raises(Exception, match="fail"):
+        await app(scope, receive, send)
+
+    assert sent[0]["status"] == 200
+    assert b"".join(m.get("body", b"") for m in sent[1:]) == (
+        b'[{"value":0},{"value":1}]'
+    )
+    assert all(m.get("more_body", False) for m in sent[1:])
+
+
+def test_websocket_generator_result():
+    from fastapi.testclient import TestClient
+
+    app, api = create_generator_app()
+    client = TestClient(app)
+
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json(REQ("count", {"n": 2}, id=1))
+        assert websocket.receive_json() == {
+            "jsonrpc": "2.0",
+            "partial": {"value": 0},
+            "id": 1,
+        }
+        assert websocket.receive_json() == {
+            "jsonrpc": "2.0",
+            "partial": {"value": 1},
+            "id": 1,
+        }
+        assert websocket.receive_json() == OK(id=1, result=None)
+
+        websocket.send_json(REQ("count", {"n": 5, "fail": True}, id=2))
+        assert websocket.receive_json()["partial"] == {"value": 0}
+        assert websocket.receive_json()["partial"] == {"value": 1}
+        assert websocket.receive_json() == ERR(
+            id=2, code=-32603, message=IGNORE, data=IGNORE
+        )
+
+
+@as_async
+async def test_dispatch_generator_result():
+    from fastjsonrpc.websocket import JsonRpcWebSocket
+
+    app, api = create_generator_app()
+    scope = {"type": "websocket", "app": app, "router": app.router}
+    websocket = JsonRpcWebSocket(scope, None, None, api)
+
+    assert await websocket.post(REQ("count_sync", {"n": 2}, id=1)) == OK(
+        id=1, result=[0, 1]
+    )
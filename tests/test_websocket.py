@@ -1,6 +1,8 @@
 import json
 
+import pytest
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocket
 
 from fastjsonrpc.exceptions import (
     InternalServerError,
@@ -29,7 +31,9 @@ def create_mock(receive_val) -> JsonRpcWebSocket:
     app, router = _sample_app_router()
     scope = {"type": "websocket", "app": app, "router": app.router}
     mock = JsonRpcWebSocket(scope, None, None, router)
-    mock.receive_text = lambda: future(receive_val)  # type: ignore
+    key = "text" if isinstance(receive_val, str) else "bytes"
+    message = {"type": "websocket.receive", key: receive_val}
+    mock.receive = lambda: future(message)  # type: ignore
     mock.send_text = lambda val: future(None)  # type: ignore
     return mock
 
@@ -37,7 +41,7 @@ def create_mock(receive_val) -> JsonRpcWebSocket:
 @as_async
 async def test_create_mock():
     mock = create_mock("aaa")
-    assert await mock.receive_text() == "aaa"
+    assert await mock.receive_message() == "aaa"
     assert await mock.send_text("aaa") is None
 
 
@@ -52,7 +56,7 @@ async def test_receive_rpc_response():
     mock = create_mock(json.dumps(payload))
     res = await mock.receive_rpc_response()
     assert res == ERR(
-        id=None,  # TODO: return id
+        id=0,
         code=RpcError.code,
         message=RpcError.message,
         data="err!",
@@ -62,13 +66,29 @@ async def test_receive_rpc_response():
     mock = create_mock(json.dumps(payload))
     res = await mock.receive_rpc_response()
     assert res == ERR(
-        id=None,  # TODO: return id
+        id=0,
         code=InternalServerError.code,
         message=InternalServerError.message,
         data=None,
     )
 
 
+@as_async
+async def test_receive_batch():
+    payload = [REQ("echo", {"msg": "hello"}, id=0), REQ("xxx", id=1)]
+    mock = create_mock(json.dumps(payload))
+    res = await mock.receive_rpc_response()
+    assert res == [
+        OK(id=0, result="hello"),
+        ERR(
+            id=1,
+            code=MethodNotFoundError.code,
+            message=MethodNotFoundError.message,
+            data=None,
+        ),
+    ]
+
+
 @as_async
 async def test_receive_jsonrpc_error():
     mock = create_mock("")
@@ -116,10 +136,10 @@ async def test_receive_jsonrpc_error():
         data=IGNORE,
     )
 
-    mock = create_mock('{"jsonrpc": "2.0", "method": "xxx", "params": {}}')
+    mock = create_mock('{"jsonrpc": "2.0", "method": "xxx", "params": {}, "id": 0}')
     res = await mock.receive_rpc_response()
     assert res == ERR(
-        id=None,
+        id=0,
         code=MethodNotFoundError.code,
         message=MethodNotFoundError.message,
         data=IGNORE,
@@ -239,9 +259,268 @@ def test_websocket_publish():
         assert data == {"jsonrpc": "2.0", "result": "hello", "id": 2}
 
 
+def create_serving_app(max_in_flight):
+    import asyncio
+
+    from fastapi import FastAPI
+    from pydantic import BaseModel
+
+    from fastjsonrpc import JsonRpcRouter
+
+    rpc = JsonRpcRouter()
+
+    @rpc.post()
+    class Sleep(BaseModel):
+        seconds: float
+
+        async def __call__(self):
+            await asyncio.sleep(self.seconds)
+            return self.seconds
+
+    @rpc.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        await rpc.get_websocket(websocket).serve(max_in_flight=max_in_flight)
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+    return app
+
+
+def test_websocket_serve():
+    client = TestClient(create_serving_app(max_in_flight=2))
+    with client.websocket_connect("/jsonrpc/ws") as websocket:
+        websocket.send_json(REQ("sleep", {"seconds": 0.2}, id=1))
+        websocket.send_json(REQ("sleep", {"seconds": 0}, id=2))
+        websocket.send_json(REQ("xxx", id=3))
+        assert websocket.receive_json() == OK(id=2, result=0)
+        assert websocket.receive_json()["id"] == 3
+        assert websocket.receive_json() == OK(id=1, result=0.2)
+
+
+def test_websocket_serve_backpressure():
+    client = TestClient(create_serving_app(max_in_flight=1))
+    with client.websocket_connect("/jsonrpc/ws") as websocket:
+        websocket.send_json(REQ("sleep", {"seconds": 0.1}, id=1))
+        websocket.send_json(REQ("sleep", {"seconds": 0}, id=2))
+        assert websocket.receive_json() == OK(id=1, result=0.1)
+        assert websocket.receive_json() == OK(id=2, result=0)
+
+
+def test_websocket_serve_binary_frame():
+    client = TestClient(create_serving_app(max_in_flight=1))
+    with client.websocket_connect("/jsonrpc/ws") as websocket:
+        websocket.send_bytes(b'{"jsonrpc": "2.0", "method": "sleep", "params"')
+        assert websocket.receive_json()["error"]["code"] == ParseError.code
+        websocket.send_bytes(b'{"jsonrpc": "2.0", "method": "xxx", "id": 1}')
+        assert websocket.receive_json()["error"]["code"] == MethodNotFoundError.code
+        websocket.send_json(REQ("sleep", {"seconds": 0}, id=2))
+        assert websocket.receive_json() == OK(id=2, result=0)
+
+
+def test_websocket_serve_max_in_flight():
+    app = create_serving_app(max_in_flight=0)
+    client = TestClient(app)
+    with pytest.raises(ValueError, match="must be greater than 0"):
+        with client.websocket_connect("/jsonrpc/ws"):
+            ...
+
+
 def test_websocket_state():
-    # TODO: implement
-    ...
+    from fastapi import FastAPI, Request
+    from pydantic import BaseModel
+
+    from fastjsonrpc import JsonRpcRouter
+
+    rpc = JsonRpcRouter()
+
+    @rpc.post()
+    class CountUp(BaseModel):
+        def __call__(self, request: Request):
+            request.state.count = getattr(request.state, "count", 0) + 1
+            return request.state.count
+
+    @rpc.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        stateful = rpc.get_websocket(websocket, use_state=True)
+        stateless = rpc.get_websocket(websocket)
+        for client in [stateful, stateful, stateless, stateless]:
+            res = await client.post(REQ("count_up", id=1))
+            await websocket.send_json(res)
+        await websocket.close()
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+
+    client = TestClient(app)
+    with client.websocket_connect("/jsonrpc/ws") as websocket:
+        assert websocket.receive_json() == OK(id=1, result=1)
+        assert websocket.receive_json() == OK(id=1, result=2)
+        assert websocket.receive_json() == OK(id=1, result=1)
+        assert websocket.receive_json() == OK(id=1, result=1)
+
+
+@pytest.mark.parametrize(
+    "subprotocol, module", [("jsonrpc.msgpack", "msgpack"), ("jsonrpc.cbor", "cbor2")]
+)
+def test_binary_codec(subprotocol, module):
+    pytest.importorskip(module)
+    from fastjsonrpc.codec import BINARY_CODECS
+
+    codec = BINARY_CODECS[subprotocol]()
+    result = codec.dumps([1.5, "a"])
+    assert codec.loads(codec.render_response(result, 1)) == OK(id=1, result=[1.5, "a"])
+    assert codec.loads(codec.render_partial(result, None)) == {
+        "jsonrpc": "2.0",
+        "partial": [1.5, "a"],
+        "id": None,
+    }
+    for size in [0, 3, 30, 300, 70000]:
+        contents = [codec.dumps(i) for i in range(size)]
+        assert codec.loads(codec.render_batch(contents)) == list(range(size))
+
+    err = RpcError("err!")
+    assert codec.loads(codec.render_error(err, 2)) == err.to_dict(id=2)
+
+
+def create_binary_app():
+    from fastapi import FastAPI
+    from pydantic import BaseModel
+
+    from fastjsonrpc import JsonRpcRouter
+
+    rpc = JsonRpcRouter()
+
+    @rpc.post()
+    class Echo(BaseModel):
+        msg: str
+
+        def __call__(self):
+            return self.msg
+
+    @rpc.post()
+    class Count(BaseModel):
+        n: int
+
+        def __call__(self):
+            yield from range(self.n)
+
+    @rpc.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        rpc_websocket = rpc.get_websocket(websocket)
+        await rpc_websocket.accept()
+        await rpc_websocket.serve(max_in_flight=1)
+
+    app = FastAPI()
+    app.include_router(rpc, prefix="/jsonrpc")
+    return app
+
+
+@pytest.mark.parametrize(
+    "subprotocol, module", [("jsonrpc.msgpack", "msgpack"), ("jsonrpc.cbor", "cbor2")]
+)
+def test_websocket_binary_subprotocol(subprotocol, module):
+    pytest.importorskip(module)
+    from fastjsonrpc.codec import BINARY_CODECS
+
+    codec = BINARY_CODECS[subprotocol]()
+    client = TestClient(create_binary_app())
+    with client.websocket_connect(
+        "/jsonrpc/ws", subprotocols=["unknown", subprotocol]
+    ) as websocket:
+        assert websocket.accepted_subprotocol == subprotocol
+
+        def call(payload):
+            websocket.send_bytes(codec.dumps(payload))
+            return codec.loads(websocket.receive_bytes())
+
+        assert call(REQ("echo", {"msg": "hello"}, id=1)) == OK(id=1, result="hello")
+        assert call([REQ("echo", {"msg": "a"}, id=2), REQ("xxx", id=3)]) == [
+            OK(id=2, result="a"),
+            ERR(
+                id=3,
+                code=MethodNotFoundError.code,
+                message=MethodNotFoundError.message,
+                data=None,
+            ),
+        ]
+        assert call(REQ("echo", {}, id=4))["error"]["code"] == InvalidParamsError.code
+
+        websocket.send_bytes(b"\xc1")
+        assert codec.loads(websocket.receive_bytes())["error"]["code"] == (
+            ParseError.code
+        )
+
+        websocket.send_text('{"jsonrpc": "2.0", "method": "echo", "id": 6}')
+        assert codec.loads(websocket.receive_bytes())["error"]["code"] == (
+            ParseError.code
+        )
+
+        websocket.send_bytes(codec.dumps(REQ("count", {"n": 2}, id=5)))
+        frames = [codec.loads(websocket.receive_bytes()) for _ in range(3)]
+        assert frames == [
+            {"jsonrpc": "2.0", "partial": 0, "id": 5},
+            {"jsonrpc": "2.0", "partial": 1, "id": 5},
+            OK(id=5, result=None),
+        ]
+
+
+def test_websocket_without_subprotocol():
+    client = TestClient(create_binary_app())
+    with client.websocket_connect("/jsonrpc/ws", subprotocols=["xxx"]) as websocket:
+        assert websocket.accepted_subprotocol is None
+        websocket.send_json(REQ("echo", {"msg": "hello"}, id=1))
+        assert websocket.receive_json() == OK(id=1, result="hello")
+
+
+@as_async
+async def test_session_fast_path(monkeypatch):
+    from fastjsonrpc.handler import JsonRpcRequest
+
+    app, router = _sample_app_router()
+    scope = {"type": "websocket", "app": app, "router": app.router}
+    websocket = JsonRpcWebSocket(scope, None, None, router)
+    client = TestClient(app)
+
+    parsed = []
+    parse_envelope = JsonRpcRequest.parse_envelope
+
+    def spy(body, *args, **kwargs):
+        parsed.append(body)
+        return parse_envelope(body, *args, **kwargs)
+
+    monkeypatch.setattr(JsonRpcRequest, "parse_envelope", staticmethod(spy))
+
+    fast = [
+        REQ("echo", {"msg": "a"}, id=1),
+        {"method": "echo", "params": {"msg": "a"}, "id": 1},
+        {"id": 2, "params": {"msg": "b"}, "method": "echo", "jsonrpc": "2.0"},
+        REQ("echo", {}, id=3),
+    ]
+    slow = [
+        REQ("xxx", id=1),
+        REQ("echo", {"msg": "a"}, id="1"),
+        REQ("echo", ["a"], id=1),
+        {"jsonrpc": "1.0", "method": "echo", "params": {"msg": "a"}, "id": 1},
+        {"jsonrpc": "2.0", "method": "echo", "params": {"msg": "a"}, "id": 1, "x": 1},
+        {"jsonrpc": "2.0", "method": ["echo"], "id": 1},
+        REQ("", id=1),
+        [REQ("echo", {"msg": "z"}, id=9)],
+    ]
+
+    expectations = [client.post("/", json=req).json() for req in fast + slow]
+    parsed.clear()
+
+    for req, expected in zip(fast + slow, expectations):
+        assert json.loads(await websocket.request_rpc_text(json.dumps(req))) == (
+            expected
+        )
+        assert await websocket.post(req) == expected
+
+    assert not any(req in parsed for req in fast)
+    assert all(req in parsed for req in slow)
+    assert set(websocket._session.routes) == {"echo"}
 
 
 """